@@ -1,26 +1,85 @@
 import os
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
 from dotenv import load_dotenv
+from utils import json_loads
 
 load_dotenv()
 
+# Environment is resolved once at import; config objects are built per DAL/page
+_COUCHBASE_HOST = os.getenv("COUCHBASE_HOST")
+_COUCHBASE_PORT = os.getenv("COUCHBASE_PORT", 8091)
+_COUCHBASE_USER = os.getenv("COUCHBASE_USER", "Administrator")
+_COUCHBASE_PASSWORD = os.getenv("COUCHBASE_PASSWORD", "password")
+_CB_UPSERT_BATCH_SIZE = int(os.getenv("CB_UPSERT_BATCH_SIZE", 500))
+
+_MONGODB_HOST = os.getenv("MONGODB_HOST", "localhost")
+_MONGODB_PORT = os.getenv("MONGODB_PORT", 27017)
+_MONGODB_USER = os.getenv("MONGODB_USER", "admin")
+_MONGODB_PASSWORD = os.getenv("MONGODB_PASSWORD", "password")
+_MONGODB_TLS = os.getenv("MONGODB_TLS", "false")
+_MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "migra")
+_MONGODB_CONNECTION_STRING = os.getenv(
+    "MONGODB_CONNECTION_STRING",
+    f"mongodb://{_MONGODB_USER}:{_MONGODB_PASSWORD}@{_MONGODB_HOST}:{_MONGODB_PORT}"
+)
+_MONGODB_INSERT_BATCH_SIZE = int(os.getenv("MONGODB_INSERT_BATCH_SIZE", 1000))
+# Wire compression, negotiated with the server in this order; empty disables it.
+# snappy is left out: it needs python-snappy, which requirements.txt does not install
+_MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zstd,zlib")
+
+# Worker threads of the migration scripts; unset or 0 sizes them from the available CPUs
+_MIGRATE_MAX_WORKERS = int(os.getenv("MIGRATE_MAX_WORKERS", 0))
+
+# Database name -> bucket names to migrate; resolved next to this file, not the working directory
+_DB_SETTING_PATH = Path(__file__).with_name("dbsetting.json")
+
+
+@lru_cache(maxsize=None)
+def get_db_setting():
+    """
+    Return the parsed dbsetting.json, read once per process.
+    The mapping is read-only because every caller shares the same object.
+    """
+    return MappingProxyType(json_loads(_DB_SETTING_PATH.read_bytes()))
+
+
+def get_max_workers() -> int:
+    """
+    Return the number of worker threads for the migration scripts: MIGRATE_MAX_WORKERS if set,
+    otherwise 4 per CPU this process may run on, between 4 and 32.
+    The workers mostly wait on the network, so there are several per CPU.
+    """
+    if _MIGRATE_MAX_WORKERS > 0:
+        return _MIGRATE_MAX_WORKERS
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on Windows/macOS
+        cpus = os.cpu_count() or 1
+    return max(4, min(32, 4 * cpus))
+
+
 class CouchbaseConfig:
 
     def __init__(self):
-        self.host = os.getenv("COUCHBASE_HOST")
-        self.port = os.getenv("COUCHBASE_PORT", 8091)
-        self.user = os.getenv("COUCHBASE_USER", "Administrator")
-        self.password = os.getenv("COUCHBASE_PASSWORD", "password")
+        self.host = _COUCHBASE_HOST
+        self.port = _COUCHBASE_PORT
+        self.user = _COUCHBASE_USER
+        self.password = _COUCHBASE_PASSWORD
+        self.upsert_batch_size = _CB_UPSERT_BATCH_SIZE
 
 
 class MongoDBConfig:
 
     def __init__(self, database_name: str=None):
-        self.host = os.getenv("MONGODB_HOST", "localhost")
-        self.port = os.getenv("MONGODB_PORT", 27017)
-        self.user = os.getenv("MONGODB_USER", "admin")
-        self.password = os.getenv("MONGODB_PASSWORD", "password")
-        self.tls = os.getenv("MONGODB_TLS", "false")
-        self.database = database_name if database_name else os.getenv("MONGODB_DB_NAME", "migra")
-        
-        _connection_string = f"mongodb://{self.user}:{self.password}@{self.host}:{self.port}"
-        self.connection_string = os.getenv("MONGODB_CONNECTION_STRING", _connection_string)
\ No newline at end of file
+        self.host = _MONGODB_HOST
+        self.port = _MONGODB_PORT
+        self.user = _MONGODB_USER
+        self.password = _MONGODB_PASSWORD
+        self.tls = _MONGODB_TLS
+        self.database = database_name if database_name else _MONGODB_DB_NAME
+        self.connection_string = _MONGODB_CONNECTION_STRING
+        self.insert_batch_size = _MONGODB_INSERT_BATCH_SIZE
+        self.compressors = _MONGODB_COMPRESSORS
@@ -1,51 +1,228 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import timedelta
+from collections import deque
+from collections.abc import Mapping
+from itertools import chain, count
+import logging
 import os
-import sys
-import gc
+import queue
+import re
+import socket
+import threading
 import time
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import CouchbaseConfig
 from couchbase.auth import PasswordAuthenticator
 from couchbase.cluster import Cluster
-from couchbase.exceptions import CouchbaseException, BucketNotFoundException, AmbiguousTimeoutException
+from couchbase.exceptions import (CouchbaseException, BucketNotFoundException, BucketDoesNotExistException,
+                                  AmbiguousTimeoutException, UnAmbiguousTimeoutException)
 from couchbase.management.buckets import BucketManager, CreateBucketSettings, BucketType
 from couchbase.options import ClusterOptions, QueryOptions, ClusterTimeoutOptions
 from logger_config import get_logger
-import uuid
-import json
+from utils import cap_batch_size, chunked, json_dumps, json_loads
 
 logger = get_logger(__name__)
 
+# Cluster timeouts; connect_timeout can be overridden per connect() call
+_DEFAULT_CONNECT_TIMEOUT = timedelta(seconds=300)
+_SERVICE_TIMEOUTS = {
+    'kv_timeout': timedelta(seconds=60),  # Increased KV timeout for large documents
+    'query_timeout': timedelta(seconds=120),
+    'analytics_timeout': timedelta(seconds=120),
+    'search_timeout': timedelta(seconds=30),
+    'views_timeout': timedelta(seconds=30),
+    'management_timeout': timedelta(seconds=30),
+}
+
+# Errors that make adaptive pagination shrink the page size
+_TIMEOUT_ERRORS = (AmbiguousTimeoutException, UnAmbiguousTimeoutException)
+
+# Maximum number of keys sent in one get_multi call
+_GET_MULTI_CHUNK_SIZE = 1000
+
+# Used by get_data to strip existing LIMIT/OFFSET clauses before appending its own
+_PAGINATION_RE = re.compile(r'\s+(?:LIMIT|OFFSET)\s+\d+', re.IGNORECASE)
+
+# Fields holding the document ID in exported documents, in lookup order
+_ID_KEYS = ('id', '_id', 'key')
+_ID_KEY_SET = frozenset(_ID_KEYS)
+
+# First characters a JSON document can start with (object, array, string, number, true/false/null)
+_JSON_START_CHARS = frozenset('{["-0123456789tfn')
+
+# client_context_id only needs to be unique for server-side request tracing;
+# host and pid tell apart migration processes running against the same cluster
+_CONTEXT_ID_PREFIX = f"{socket.gethostname()[:8]}-{os.getpid()}-"
+_context_ids = count()
+
+
+def _next_context_id() -> str:
+    return f"{_CONTEXT_ID_PREFIX}{next(_context_ids)}"
+
+
+def _row_to_dict(row, debug: bool = False):
+    """
+    Convert a query row of unknown shape to a dictionary.
+    Returns: dict (or the decoded value for RAW rows), None if the row could not be converted
+    """
+    row_dict = None
+    
+    # Method 1: Row is already a dict
+    if isinstance(row, dict):
+        row_dict = row
+    # Method 2: Try direct dict conversion (most common case)
+    elif hasattr(row, '__iter__') and not isinstance(row, str):
+        try:
+            row_dict = dict(row) if row else None
+        except (TypeError, ValueError):
+            pass
+    
+    # Method 3: If dict conversion didn't work, normalize through JSON (default=str handles any object)
+    if not row_dict:
+        try:
+            row_dict = json_loads(json_dumps(row, default=str))
+        except (TypeError, ValueError) as json_err:
+            if debug:
+                logger.debug("JSON conversion failed: %s", json_err)
+    
+    # Method 4: Last resort - manual attribute extraction
+    if not row_dict:
+        row_dict = {}
+        # Try common attributes
+        for attr in ['id', 'value', 'key', 'doc']:
+            if hasattr(row, attr):
+                val = getattr(row, attr)
+                if isinstance(val, dict):
+                    row_dict.update(val)
+                else:
+                    row_dict[attr] = val
+        
+        # If still empty, try __dict__
+        if not row_dict and hasattr(row, '__dict__'):
+            row_dict = {k: v for k, v in row.__dict__.items() 
+                      if not k.startswith('_') and not callable(v)}
+    
+    return row_dict
+
+
+def _make_row_converter(first_row, debug: bool = False):
+    """
+    Pick a row converter once per result set, based on the shape of the first row.
+    Returns: callable taking a row and returning its dictionary (or None)
+    """
+    if isinstance(first_row, Mapping):
+        return dict
+    if hasattr(first_row, 'id') and hasattr(first_row, 'value'):
+        return lambda row: {'id': row.id, 'value': row.value}
+    return lambda row: _row_to_dict(row, debug)
+
+
+def _normalize_docs(documents: list, bucket_name: str):
+    """
+    Turn exported documents into (doc_id, doc_content) pairs ready for upsert, in one pass.
+    Expected structure: document["id"] is the document ID, document[bucket_name] is the value.
+    Returns: (normalized, invalid) - list of (doc_id, dict) tuples and list of skip messages as
+             logging (format, *args) tuples, so documents are only formatted if the message is emitted
+    """
+    normalized = []
+    invalid = []
+    for doc in documents:
+        try:
+            if not isinstance(doc, dict):
+                invalid.append(("Skipping non-dict document: %s", type(doc)))
+                continue
+            
+            # Extract document ID from document["id"], falling back to other common ID fields
+            doc_id = next((doc[key] for key in _ID_KEYS if doc.get(key)), None)
+            if not doc_id:
+                invalid.append(("Skipping document without ID: %s", doc))
+                continue
+            
+            # Get document value from document[bucket_name]
+            doc_value = doc.get(bucket_name)
+            
+            # If bucket_name field doesn't exist, try 'value' field as fallback
+            if doc_value is None:
+                doc_value = doc.get('value')
+            
+            # If still no value, use the entire doc (excluding id fields)
+            if doc_value is None:
+                doc_value = {k: v for k, v in doc.items() if k not in _ID_KEY_SET}
+                if not doc_value:
+                    invalid.append(("Skipping document with no value: %s", doc_id))
+                    continue
+            
+            # Convert value to dict if needed
+            if isinstance(doc_value, dict):
+                doc_content = doc_value  # upsert only serializes it, no copy needed
+            elif isinstance(doc_value, str):
+                # Try to parse string as JSON, unless its first character cannot start a JSON value
+                if doc_value.lstrip()[:1] not in _JSON_START_CHARS:
+                    doc_content = {"value": doc_value}
+                else:
+                    try:
+                        doc_content = json_loads(doc_value)
+                        if not isinstance(doc_content, dict):
+                            # If parsed result is not a dict, wrap it
+                            doc_content = {"value": doc_content}
+                    except ValueError:
+                        # If not valid JSON, wrap the string as dict
+                        doc_content = {"value": doc_value}
+            else:
+                # For other types (list, number, etc.), wrap in dict
+                doc_content = {"value": doc_value}
+            
+            normalized.append((doc_id, doc_content))
+        except Exception as e:
+            invalid.append(("Error processing document (ID: %s): %s", doc.get('id', 'unknown'), e))
+    return normalized, invalid
+
+
+def _map_bounded(executor, fn, iterable, window: int, *args):
+    """
+    Like executor.map(fn, iterable, repeat(arg)...), in order, but with at most `window` tasks
+    outstanding: the next item is read and submitted only as results are consumed, so a
+    generator input is not drained (and pickled into the pool) up front.
+    """
+    pending = deque()
+    for item in iterable:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
 class CouchbaseDataAccess:
 
     def __init__(self, config: CouchbaseConfig):
         self.config = config
         self.cluster = None
         self.bucket = None
+        self._buckets = {}  # bucket name -> Bucket, valid until close()
+        self._collections = {}  # bucket name -> default Collection, valid until close()
+        self._index_cache = {}  # (bucket name, index name) -> (exists, is_online, checked_at)
+        # Only depend on config: built once per DAL instead of on every connect()
+        self._authenticator = PasswordAuthenticator(config.user, config.password)
+        self._default_timeouts = ClusterTimeoutOptions(connect_timeout=_DEFAULT_CONNECT_TIMEOUT,
+                                                       **_SERVICE_TIMEOUTS)
         
-    def connect(self, timeout: timedelta = timedelta(seconds=300)):
+    def connect(self, timeout: timedelta = _DEFAULT_CONNECT_TIMEOUT):
         """
-        Connect to Couchbase cluster with configurable timeout
+        Connect to Couchbase cluster with configurable timeout.
+        The cluster is created once and reused by every call until close() is called.
         
         Args:
-            timeout: Timeout for cluster connection (default: 30 seconds)
+            timeout: Timeout for cluster connection (default: 300 seconds)
         """
+        if self.cluster is not None:
+            return self.cluster
         try:
-            authenticator = PasswordAuthenticator(self.config.user, self.config.password)
-            
-            # Configure timeout options
-            timeout_opts = ClusterTimeoutOptions(
-                connect_timeout=timeout,
-                kv_timeout=timedelta(seconds=60),  # Increased KV timeout for large documents
-                query_timeout=timedelta(seconds=120),
-                analytics_timeout=timedelta(seconds=120),
-                search_timeout=timedelta(seconds=30),
-                views_timeout=timedelta(seconds=30),
-                management_timeout=timedelta(seconds=30)
-            )
+            timeout_opts = self._default_timeouts
+            if timeout != _DEFAULT_CONNECT_TIMEOUT:
+                timeout_opts = ClusterTimeoutOptions(connect_timeout=timeout, **_SERVICE_TIMEOUTS)
             
-            cluster_options = ClusterOptions(authenticator, timeout_options=timeout_opts)
+            cluster_options = ClusterOptions(self._authenticator, timeout_options=timeout_opts)
             self.cluster = Cluster(f"couchbase://{self.config.host}", cluster_options)
             
             # Wait for the cluster to be ready
@@ -78,32 +255,59 @@ class CouchbaseDataAccess:
             self.cluster.close()
             self.cluster = None
             self.bucket = None
+            self._buckets.clear()
+            self._collections.clear()
             logger.info("Closing Couchbase connection")
             # Removed gc.collect() to prevent debugger hang
+
+    def _get_bucket(self, bucket_name: str):
+        """
+        Return the Bucket for bucket_name, opening it on the shared cluster the first time.
+        """
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            bucket = self.connect().bucket(bucket_name)
+            self._buckets[bucket_name] = bucket
+        self.bucket = bucket
+        return bucket
+
+    def _get_collection(self, bucket_name: str):
+        """
+        Return the default Collection of bucket_name, cached until close().
+        """
+        collection = self._collections.get(bucket_name)
+        if collection is None:
+            collection = self._get_bucket(bucket_name).default_collection()
+            self._collections[bucket_name] = collection
+        return collection
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
-    def get_data(self, query: str, debug: bool = False, offset: int = None, limit: int = None):
+    def get_data(self, query: str, debug: bool = False, offset: int = None, limit: int = None,
+                 stream: bool = False, named_parameters: dict = None, adhoc: bool = True):
         """
         Get data using N1QL query. Requires primary index on the bucket.
-        Returns: list of dictionaries (JSON-like format)
+        Returns: list of dictionaries (JSON-like format), or a generator of them when stream=True
         
         Args:
             query: N1QL query string
             debug: If True, print debug information about row structure
             offset: Optional offset for pagination
             limit: Optional limit for pagination (overrides LIMIT in query if provided)
+            stream: If True, return a generator that converts rows as they arrive instead of
+                    building the whole list. Query errors are then raised while iterating.
+            named_parameters: Optional values for $name placeholders in the query
+            adhoc: If False, the SDK prepares the statement once and reuses the cached plan
         """
         # Add pagination to query if provided
         if offset is not None or limit is not None:
             # Remove existing LIMIT and OFFSET if present
-            query_upper = query.upper()
-            if 'LIMIT' in query_upper:
-                # Remove LIMIT clause
-                import re
-                query = re.sub(r'\s+LIMIT\s+\d+', '', query, flags=re.IGNORECASE)
-            if 'OFFSET' in query_upper:
-                # Remove OFFSET clause
-                import re
-                query = re.sub(r'\s+OFFSET\s+\d+', '', query, flags=re.IGNORECASE)
+            query = _PAGINATION_RE.sub('', query)
             
             # Add pagination
             if limit is not None:
@@ -113,120 +317,133 @@ class CouchbaseDataAccess:
         
         try:
             cluster = self.connect()
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
-            result = cluster.query(query, query_options)
-            rows = []
-            first_row_processed = False
-            
-            for row in result.rows():
-                # Convert row to dictionary/JSON format
-                try:
-                    # In Couchbase Python SDK 4.x, query rows are typically dict-like
-                    # They can be accessed directly as dict or converted
-                    row_dict = None
-                    
-                    # Method 1: Row is already a dict
-                    if isinstance(row, dict):
-                        row_dict = row
-                    # Method 2: Try direct dict conversion (most common case)
-                    elif hasattr(row, '__iter__') and not isinstance(row, str):
-                        try:
-                            row_dict = dict(row) if row else None
-                        except (TypeError, ValueError):
-                            pass
-                    
-                    # Method 3: If dict conversion didn't work, try JSON serialization
-                    if not row_dict:
-                        try:
-                            # Use json.dumps with default=str to handle any object
-                            row_str = json.dumps(row, default=str, ensure_ascii=False)
-                            row_dict = json.loads(row_str)
-                        except (TypeError, ValueError, json.JSONDecodeError) as json_err:
-                            if debug:
-                                print(f"JSON conversion failed: {json_err}")
-                    
-                    # Method 4: Last resort - manual attribute extraction
-                    if not row_dict:
-                        row_dict = {}
-                        # Try common attributes
-                        for attr in ['id', 'value', 'key', 'doc']:
-                            if hasattr(row, attr):
-                                val = getattr(row, attr)
-                                if isinstance(val, dict):
-                                    row_dict.update(val)
-                                else:
-                                    row_dict[attr] = val
-                        
-                        # If still empty, try __dict__
-                        if not row_dict and hasattr(row, '__dict__'):
-                            row_dict = {k: v for k, v in row.__dict__.items() 
-                                      if not k.startswith('_') and not callable(v)}
-                    
-                    # Debug output for first row
-                    if debug and not first_row_processed:
-                        logger.debug(f"First row type: {type(row)}")
-                        logger.debug(f"First row dict: {row_dict}")
-                        logger.debug(f"First row attributes: {dir(row)[:10] if hasattr(row, '__dict__') else 'N/A'}")
-                        first_row_processed = True
-                    
-                    if row_dict:
-                        rows.append(row_dict)
-                    else:
-                        logger.warning(f"Could not convert row to dict. Type: {type(row)}")
-                        if debug:
-                            logger.debug(f"Row value: {row}")
-                        
-                except Exception as e:
-                    logger.error(f"Error processing row: {e}", exc_info=True)
-                    continue
+            option_kwargs = {'client_context_id': _next_context_id()}
+            if named_parameters:
+                option_kwargs['named_parameters'] = named_parameters
+            if not adhoc:
+                option_kwargs['adhoc'] = False
+            result = cluster.query(query, QueryOptions(**option_kwargs))
+            if stream or debug:
+                rows = self._iter_rows(result.rows(), debug=debug)
+                return rows if stream else list(rows)
+            # Materialize at C level; only convert when the SDK did not return dicts
+            rows = list(result.rows())
+            if rows and type(rows[0]) is not dict:
+                rows = list(self._iter_rows(rows))
             return rows
         except CouchbaseException as e:
             logger.error(f"Error querying Couchbase: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
-    def get_data_by_keys(self, bucket_name: str, keys: list):
+    def iter_data(self, query: str, debug: bool = False, named_parameters: dict = None,
+                  adhoc: bool = True):
+        """
+        Iterate over the rows of a N1QL query as dictionaries, converting each row as it
+        arrives instead of building a list. Same as get_data(query, stream=True).
+        
+        Args:
+            query: N1QL query string
+            debug: If True, print debug information about row structure
+            named_parameters: Optional values for $name placeholders in the query
+            adhoc: If False, the SDK prepares the statement once and reuses the cached plan
+        """
+        return self.get_data(query, debug=debug, stream=True,
+                             named_parameters=named_parameters, adhoc=adhoc)
+
+    def _iter_rows(self, rows, debug: bool = False):
+        """
+        Convert query result rows to dictionaries one at a time.
+        The row shape is checked once on the first row: SDK 4.x returns plain dicts,
+        which are passed through as-is; other shapes get a converter from _make_row_converter.
+        
+        Args:
+            rows: Iterable of query rows (e.g. result.rows())
+            debug: If True, print debug information about row structure
+        """
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        
+        # Debug output for first row
+        if debug and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("First row type: %s", type(first_row))
+            logger.debug("First row dict: %s", first_row)
+            logger.debug("First row attributes: %s", dir(first_row)[:10] if hasattr(first_row, '__dict__') else 'N/A')
+        
+        # Fast path: rows are already dicts, nothing to convert
+        if type(first_row) is dict:
+            yield first_row
+            yield from rows
+            return
+        
+        _convert = _make_row_converter(first_row, debug)
+        for row in chain((first_row,), rows):
+            try:
+                row_dict = _convert(row)
+                if row_dict:
+                    yield row_dict
+                else:
+                    logger.warning(f"Could not convert row to dict. Type: {type(row)}")
+                    if debug:
+                        logger.debug("Row value: %s", row)
+            except Exception as e:
+                logger.error(f"Error processing row: {e}", exc_info=True)
+                continue
+
+    def get_data_by_keys(self, bucket_name: str, keys: list, parallelism: int = 1):
         """
         Get data using Key-Value operations. Doesn't require index.
         Args:
             bucket_name: Name of the bucket
             keys: List of document keys to retrieve
+            parallelism: Number of threads issuing get_multi chunks concurrently (default: 1)
         Returns: list of dictionaries with 'id' and 'value' keys
         """
         try:
-            cluster = self.connect()
-            if not self.bucket or self.bucket.name != bucket_name:
-                self.bucket = cluster.bucket(bucket_name)
-            
-            collection = self.bucket.default_collection()
+            collection = self._get_collection(bucket_name)
             results = []
+            if not keys:
+                return results
             
-            for key in keys:
-                try:
-                    result = collection.get(key)
-                    results.append({
-                        'id': key,
-                        'value': result.content_as[dict]
-                    })
-                except Exception as e:
-                    logger.error(f"Error getting key {key}: {e}", exc_info=True)
-                    continue
+            # Pipelined batches instead of a round-trip per key; chunking bounds the
+            # number of in-flight operations and the size of each MultiGetResult
+            chunks = [keys[start:start + _GET_MULTI_CHUNK_SIZE]
+                      for start in range(0, len(keys), _GET_MULTI_CHUNK_SIZE)]
+            fetch_chunk = lambda chunk: collection.get_multi(chunk, return_exceptions=True)
+            if parallelism > 1 and len(chunks) > 1:
+                # The SDK releases the GIL during KV I/O; map() keeps results in input order
+                with ThreadPoolExecutor(max_workers=min(parallelism, len(chunks))) as executor:
+                    multi_results = list(executor.map(fetch_chunk, chunks))
+            else:
+                multi_results = map(fetch_chunk, chunks)
+            
+            for chunk, multi_result in zip(chunks, multi_results):
+                for key, error in multi_result.exceptions.items():
+                    logger.error(f"Error getting key {key}: {error}")
+                
+                for key in chunk:
+                    result = multi_result.results.get(key)
+                    if result is None:
+                        continue
+                    try:
+                        results.append({
+                            'id': key,
+                            'value': result.content_as[dict]
+                        })
+                    except Exception as e:
+                        logger.error(f"Error getting key {key}: {e}", exc_info=True)
+                        continue
             
             return results
         except CouchbaseException as e:
             logger.error(f"Error getting data by keys: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
-    def get_all_keys(self, bucket_name: str, limit: int = None):
+    def iter_all_keys(self, bucket_name: str, limit: int = None):
         """
-        Get all document keys from a bucket using a scan operation.
+        Iterate over document keys of a bucket as the query streams them back.
         Note: This requires a primary index or you need to know the keys beforehand.
-        Alternative: Use N1QL with USE KEYS or get keys from another source.
         """
         try:
             # Try to get keys using N1QL (requires index)
@@ -235,17 +452,31 @@ class CouchbaseDataAccess:
             if limit:
                 query += f" LIMIT {limit}"
             
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query_options = QueryOptions(client_context_id=_next_context_id())
             result = cluster.query(query, query_options)
-            keys = [row['id'] for row in result.rows()]
-            return keys
+            for row in result.rows():
+                yield row['id']
         except CouchbaseException as e:
             logger.error(f"Error getting keys (index may be required): {e}", exc_info=True)
             logger.info("Tip: You can create a primary index with: CREATE PRIMARY INDEX ON `bucket_name`")
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
+    
+    def get_all_keys(self, bucket_name: str, limit: int = None):
+        """
+        Get all document keys from a bucket using a scan operation.
+        Note: This requires a primary index or you need to know the keys beforehand.
+        Alternative: Use N1QL with USE KEYS or get keys from another source.
+        """
+        return list(self.iter_all_keys(bucket_name, limit))
+    
+    def iter_data_from_bucket(self, bucket_name: str, limit: int = 100):
+        """
+        Iterate over documents of a bucket: keys are streamed from the index and fetched with
+        Key-Value operations one chunk at a time, so the full key list is never held in memory.
+        Yields: dictionaries with 'id' and 'value' keys
+        """
+        for keys in chunked(self.iter_all_keys(bucket_name, limit), _GET_MULTI_CHUNK_SIZE):
+            yield from self.get_data_by_keys(bucket_name, keys)
     
     def get_data_from_bucket(self, bucket_name: str, limit: int = 100):
         """
@@ -254,28 +485,34 @@ class CouchbaseDataAccess:
         Returns: list of dictionaries in JSON format
         """
         try:
-            # Get all keys first
-            keys = self.get_all_keys(bucket_name, limit)
-            
-            # Get documents by keys
-            return self.get_data_by_keys(bucket_name, keys)
+            return list(self.iter_data_from_bucket(bucket_name, limit))
         except CouchbaseException as e:
             logger.error(f"Error getting data from bucket: {e}", exc_info=True)
             raise e
     
-    def check_index_status(self, bucket_name: str, index_name: str = None):
+    def check_index_status(self, bucket_name: str, index_name: str = None, ttl: float = 2.0):
         """
         Check if primary index exists and is online.
+        Results are cached per (bucket, index) for `ttl` seconds; index DDL on this DAL invalidates them.
         Returns: (exists, is_online) tuple
+        
+        Args:
+            bucket_name: Name of the bucket
+            index_name: Name of the index (default: "#primary")
+            ttl: Maximum age in seconds of a cached status (0 always queries the cluster)
         """
+        if index_name is None:
+            index_name = "#primary"
+        cache_key = (bucket_name, index_name)
+        cached = self._index_cache.get(cache_key)
+        if cached is not None and time.monotonic() - cached[2] < ttl:
+            return cached[0], cached[1]
+        
         try:
-            if index_name is None:
-                index_name = "#primary"
-            
             cluster = self.connect()
             # Query to check index status from system:indexes
             query = f"SELECT * FROM system:indexes WHERE keyspace_id = '{bucket_name}' AND name = '{index_name}' and is_primary = true"
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query_options = QueryOptions(client_context_id=_next_context_id())
             result = cluster.query(query, query_options)
             
             indexes = []
@@ -292,6 +529,7 @@ class CouchbaseDataAccess:
                             indexes.append(row)
             
             if not indexes:
+                self._index_cache[cache_key] = (False, False, time.monotonic())
                 return (False, False)
             
             # Check if index is online
@@ -303,6 +541,7 @@ class CouchbaseDataAccess:
                 state = str(getattr(index_info, 'state', '')).lower()
                 # index_key = len(getattr(index_info, 'index_key', []))
             is_ready = state == 'online' # and index_key > 0
+            self._index_cache[cache_key] = (True, is_ready, time.monotonic())
             return (True, is_ready)
         except CouchbaseException as e:
             error_msg = str(e).lower()
@@ -313,34 +552,33 @@ class CouchbaseDataAccess:
         except Exception as e:
             logger.error(f"Error checking index status: {e}", exc_info=True)
             return (False, False)
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
+    
+    def _invalidate_index_status(self, bucket_name: str):
+        """
+        Forget cached index statuses of a bucket after index DDL.
+        """
+        for cache_key in [key for key in self._index_cache if key[0] == bucket_name]:
+            del self._index_cache[cache_key]
     
     def drop_primary_index(self, bucket_name: str):
         """
-        Drop primary index on the bucket.
+        Drop primary index on the bucket (no-op if it does not exist).
         """
         try:
-            exists, _ = self.check_index_status(bucket_name)
-            if not exists:
-                return
             cluster = self.connect()
-            query = f'DROP PRIMARY INDEX ON `{bucket_name}`;'
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query = f'DROP PRIMARY INDEX IF EXISTS ON `{bucket_name}`;'
+            query_options = QueryOptions(client_context_id=_next_context_id())
             cluster.query(query, query_options).execute()
+            self._invalidate_index_status(bucket_name)
             logger.info(f"Primary index dropped for bucket: {bucket_name.upper()}")
         except CouchbaseException as e:
             logger.error(f"Error dropping primary index: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
             
     
     def create_primary_index(self, bucket_name: str):
         """
-        Create a primary index on the bucket.
+        Create a primary index on the bucket (no-op if it already exists).
         This is required for N1QL queries without USE KEYS clause.
         
         Args:
@@ -348,16 +586,14 @@ class CouchbaseDataAccess:
         """
         try:
             cluster = self.connect()
-            query = f'CREATE PRIMARY INDEX `#primary` ON `{bucket_name}` WITH {{"defer_build": true}};'
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query = f'CREATE PRIMARY INDEX IF NOT EXISTS `#primary` ON `{bucket_name}` WITH {{"defer_build": true}};'
+            query_options = QueryOptions(client_context_id=_next_context_id())
             cluster.query(query, query_options).execute()
+            self._invalidate_index_status(bucket_name)
             logger.info(f"Primary index creation initiated for bucket: {bucket_name.upper()}")
         except CouchbaseException as e:
             logger.error(f"Error creating primary index: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
     def build_primary_index(self, bucket_name: str):
         """
@@ -366,15 +602,13 @@ class CouchbaseDataAccess:
         try:
             cluster = self.connect()
             query = f'BUILD INDEX ON `{bucket_name}` (`#primary`);'
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query_options = QueryOptions(client_context_id=_next_context_id())
             cluster.query(query, query_options).execute()
+            self._invalidate_index_status(bucket_name)
             logger.info(f"Primary index build initiated for bucket: {bucket_name.upper()}")
         except CouchbaseException as e:
             logger.error(f"Error building primary index: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
     def get_data_as_json(self, query: str = None, bucket_name: str = None, limit: int = 100, keys: list = None):
         """
@@ -393,31 +627,39 @@ class CouchbaseDataAccess:
         else:
             raise ValueError("Either query, bucket_name, or keys must be provided")
         
-        return json.dumps(data, indent=2, ensure_ascii=False)
+        return json_dumps(data, indent=True)
         
 
     def wait_for_index(self, bucket_name: str, index_name: str = None, max_wait: int = 300, check_interval: int = 5):
         """
         Wait for primary index to be online.
+        Polls the query index management API on one cluster connection instead of
+        running a system:indexes query per check.
         Returns: True if index is online, False if timeout
         """
         if index_name is None:
             index_name = "#primary"
         
-        import time
+        index_manager = self.connect().query_indexes()
         elapsed = 0
         
         logger.info(f"Waiting for primary index on `{bucket_name}` to be online...")
         while elapsed < max_wait:
-            exists, is_online = self.check_index_status(bucket_name, index_name)
-            if exists and is_online:
+            try:
+                index = next((idx for idx in index_manager.get_all_indexes(bucket_name)
+                              if idx.name == index_name), None)
+            except CouchbaseException as e:
+                logger.warning(f"Could not check index status: {e}")
+                index = None
+            
+            if index is not None and str(index.state).lower() == 'online':
                 logger.info(f"Primary index is now online!")
                 return True
             
-            if not exists:
-                logger.debug(f"Index not found yet... ({elapsed}s/{max_wait}s)")
+            if index is None:
+                logger.debug("Index not found yet... (%ss/%ss)", elapsed, max_wait)
             else:
-                logger.debug(f"Index exists but not online yet... ({elapsed}s/{max_wait}s)")
+                logger.debug("Index exists but not online yet... (%ss/%ss)", elapsed, max_wait)
             
             time.sleep(check_interval)
             elapsed += check_interval
@@ -425,10 +667,38 @@ class CouchbaseDataAccess:
         logger.warning(f"Timeout waiting for index to be online after {max_wait} seconds")
         return False
     
+    @staticmethod
+    def _build_page_query(bucket_name: str, select_fields: str, where_clause: str = None,
+                          order_by: str = None, keyset: bool = False):
+        """
+        Build the parameterized page query used by get_data_paginated.
+        The text only depends on the scan (not the page), so it is built once per scan and
+        prepared once (adhoc=False); pages only bind $limit/$offset or $last_key.
+        
+        Args:
+            bucket_name: Name of the bucket
+            select_fields: Fields to select
+            where_clause: Optional WHERE clause (without WHERE keyword)
+            order_by: Optional ORDER BY clause, ignored for keyset queries
+            keyset: If True, seek with meta().id > $last_key ORDER BY meta().id instead of OFFSET
+        """
+        query = f"SELECT {select_fields} FROM `{bucket_name}`"
+        if keyset:
+            query += " WHERE meta().id > $last_key"
+            if where_clause:
+                query += f" AND ({where_clause})"
+            return query + " ORDER BY meta().id LIMIT $limit"
+        if where_clause:
+            query += f" WHERE {where_clause}"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        return query + " LIMIT $limit OFFSET $offset"
+    
     def get_data_paginated(self, bucket_name: str, page_size: int = 1000, offset: int = 0, 
                           select_fields: str = "meta().id, *", where_clause: str = None, 
                           order_by: str = None, debug: bool = False, max_retries: int = 3, 
-                          retry_delay: int = 2):
+                          retry_delay: int = 2, last_key: str = None, raise_on_error: bool = False,
+                          query: str = None):
         """
         Get data from bucket with pagination support and retry logic.
         Nếu có lỗi (timeout hoặc connection), sẽ retry bằng cách gọi lại chính nó.
@@ -436,32 +706,43 @@ class CouchbaseDataAccess:
         Args:
             bucket_name: Name of the bucket
             page_size: Number of records per page (default: 1000)
-            offset: Starting offset for pagination (default: 0)
+            offset: Starting offset for pagination (default: 0), ignored when last_key is given
             select_fields: Fields to select (default: "meta().id,*")
             where_clause: Optional WHERE clause (without WHERE keyword)
-            order_by: Optional ORDER BY clause (without ORDER BY keywords)
+            order_by: Optional ORDER BY clause (without ORDER BY keywords), ignored when last_key is given
             debug: If True, print debug information
             max_retries: Maximum number of retry attempts (default: 3)
             retry_delay: Delay in seconds between retries (default: 2)
+            last_key: Document id of the last row of the previous page. When given, the page is
+                      fetched with keyset pagination (meta().id > last_key ORDER BY meta().id)
+                      instead of OFFSET, so the server does not rescan skipped rows.
+            raise_on_error: If True, re-raise the last error instead of returning an empty list
+            query: Page query already built by _build_page_query for this scan; when given,
+                   select_fields/where_clause/order_by are not used again
             
         Returns:
             list: List of dictionaries containing the data, or empty list if all retries fail
         """
-        # Build query
-        query = f"SELECT {select_fields} FROM `{bucket_name}`"
-        if where_clause:
-            query += f" WHERE {where_clause}"
-        if order_by:
-            query += f" ORDER BY {order_by}"
-        query += f" LIMIT {page_size} OFFSET {offset}"
+        keyset = last_key is not None
+        if query is None:
+            query = self._build_page_query(bucket_name, select_fields, where_clause, order_by, keyset)
+        if keyset:
+            named_parameters = {'last_key': last_key, 'limit': page_size}
+            position = f"last_key={last_key}"
+        else:
+            named_parameters = {'limit': page_size, 'offset': offset}
+            position = f"offset={offset}"
         
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
         for attempt in range(max_retries):
             try:
-                logger.debug(f"=" * 90)
-                logger.debug(f"Executing to fetch data from bucket {bucket_name.upper()} with: offset={offset}, limit={page_size}")
-                logger.debug(f"Query: {query}")
-                logger.debug(f"=" * 90)
-                return self.get_data(query, debug=debug)
+                if debug_enabled:
+                    logger.debug("=" * 90)
+                    logger.debug("Executing to fetch data from bucket %s with: %s, limit=%d",
+                                 bucket_name.upper(), position, page_size)
+                    logger.debug("Query: %s", query)
+                    logger.debug("=" * 90)
+                return self.get_data(query, debug=debug, named_parameters=named_parameters, adhoc=False)
             except Exception as e:
                 if attempt < max_retries - 1:
                     wait_time = retry_delay * (attempt + 1)  # Exponential backoff
@@ -475,16 +756,18 @@ class CouchbaseDataAccess:
                 else:
                     # Đã hết số lần retry, ghi nhận lỗi và trả về empty list
                     logger.error(
-                        f"Failed to get data for {bucket_name.upper()} at offset {offset} with page_size {page_size} after {max_retries} attempts. "
+                        f"Failed to get data for {bucket_name.upper()} at {position} with page_size {page_size} after {max_retries} attempts. "
                         f"Error: {e}. Skipping this page.",
                         exc_info=True
                     )
+                    if raise_on_error:
+                        raise e
                     return []
         
         # Nếu đến đây thì đã hết retry
         logger.error(f"=" * 120)
         logger.error(f"Bucket: {bucket_name.upper()}."
-                     f"Failed to get data at offset {offset} with page_size {page_size}."
+                     f"Failed to get data at {position} with page_size {page_size}."
                      f"Skipping this page for bucket {bucket_name.upper()} after {max_retries} attempts.")
         logger.error(f"=" * 120)
         return []
@@ -493,10 +776,14 @@ class CouchbaseDataAccess:
                                select_fields: str = "meta().id,*", where_clause: str = None,
                                order_by: str = None, max_records: int = None, 
                                debug: bool = False, max_retries: int = 3, 
-                               retry_delay: int = 2):
+                               retry_delay: int = 2, adaptive_page_size: bool = False,
+                               min_page_size: int = 64, max_page_size: int = 16384,
+                               target_page_seconds: float = 0.5):
         """
         Generator function to fetch all data from bucket using pagination.
         Yields data page by page. get_data_paginated đã xử lý retry và trả về empty list nếu lỗi.
+        When no custom order_by is given and meta().id is selected, pages are fetched with
+        keyset pagination on meta().id; otherwise LIMIT/OFFSET is used.
         
         Args:
             bucket_name: Name of the bucket
@@ -508,6 +795,11 @@ class CouchbaseDataAccess:
             debug: If True, print debug information
             max_retries: Maximum number of retry attempts (default: 3)
             retry_delay: Delay in seconds between retries (default: 2)
+            adaptive_page_size: If True, double page_size while full pages take less than
+                                target_page_seconds and halve it when a page times out
+            min_page_size: Lower bound for adaptive page_size (default: 64)
+            max_page_size: Upper bound for adaptive page_size (default: 16384)
+            target_page_seconds: Page time under which page_size is increased (default: 0.5)
             
         Yields:
             tuple: (offset, list) - Offset and list of dictionaries for each page
@@ -516,24 +808,60 @@ class CouchbaseDataAccess:
         total_fetched = 0
         consecutive_empty_pages = 0
         max_consecutive_empty = 10  # Stop if too many consecutive empty pages (failed pages)
+        use_keyset = order_by in (None, "meta().id") and "meta().id" in select_fields
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        # Keyset scans start below the smallest document id, so every page (including the
+        # first) binds the same prepared statement
+        last_key = "" if use_keyset else None
+        # The page query is invariant for the whole scan: build it once
+        query = self._build_page_query(bucket_name, select_fields, where_clause, order_by, keyset=use_keyset)
         
-        logger.info(f"Starting paginated fetch from bucket: {bucket_name} (page_size: {page_size})")
+        logger.info(f"Starting paginated fetch from bucket: {bucket_name} (page_size: {page_size}, "
+                    f"{'keyset' if use_keyset else 'offset'} pagination)")
         
         while True:
             # Fetch one page (đã có retry logic bên trong)
-            page_data = self.get_data_paginated(
-                bucket_name=bucket_name,
-                page_size=page_size,
-                offset=offset,
-                select_fields=select_fields,
-                where_clause=where_clause,
-                order_by=order_by,
-                debug=debug,
-                max_retries=max_retries,
-                retry_delay=retry_delay
-            )
+            page_started = time.monotonic()
+            try:
+                page_data = self.get_data_paginated(
+                    bucket_name=bucket_name,
+                    page_size=page_size,
+                    offset=offset,
+                    select_fields=select_fields,
+                    where_clause=where_clause,
+                    order_by=order_by,
+                    debug=debug,
+                    max_retries=max_retries,
+                    retry_delay=retry_delay,
+                    last_key=last_key,
+                    raise_on_error=use_keyset or adaptive_page_size,
+                    query=query
+                )
+            except Exception as e:
+                if adaptive_page_size and page_size > min_page_size and isinstance(e, _TIMEOUT_ERRORS):
+                    # Retry the same position with a smaller page
+                    page_size = max(page_size // 2, min_page_size)
+                    logger.warning(f"Page timed out, reducing page_size to {page_size}")
+                    continue
+                consecutive_empty_pages += 1
+                if consecutive_empty_pages >= max_consecutive_empty:
+                    logger.warning(
+                        f"Too many consecutive failed pages ({consecutive_empty_pages}). "
+                        f"Stopping pagination. Total fetched: {total_fetched}"
+                    )
+                    if use_keyset:
+                        # The rest of the scan is unreachable without this page: do not end it as if complete
+                        raise e
+                    break
+                # Keyset pages cannot be skipped: retry from the same key
+                if not use_keyset:
+                    offset += page_size
+                continue
             
             if not page_data or len(page_data) == 0:
+                if use_keyset:
+                    logger.info(f"Reached end of data. Total fetched: {total_fetched}")
+                    break
                 consecutive_empty_pages += 1
                 if consecutive_empty_pages >= max_consecutive_empty:
                     logger.warning(
@@ -548,15 +876,21 @@ class CouchbaseDataAccess:
             # Reset counter khi có data
             consecutive_empty_pages = 0
             
+            # Read the seek key before handing the page to the caller, who may modify it
+            page_count = len(page_data)
+            if use_keyset:
+                last_key = page_data[-1]['id']
+            
             # Yield the page with offset info
             yield (offset, page_data)
             
             # Update counters
-            page_count = len(page_data)
             total_fetched += page_count
             offset += page_size
             
-            logger.debug(f"Fetched page at offset {offset - page_size}: {page_count} records, Total: {total_fetched}")
+            if debug_enabled:
+                logger.debug("Fetched page at offset %d: %d records, Total: %d",
+                             offset - page_size, page_count, total_fetched)
             
             # Check if we've reached max_records
             if max_records and total_fetched >= max_records:
@@ -567,62 +901,296 @@ class CouchbaseDataAccess:
             if page_count < page_size:
                 logger.info(f"Reached end of data. Total fetched: {total_fetched}")
                 break
+            
+            # Full page well under the target time: fetch more per round-trip
+            if adaptive_page_size and page_size < max_page_size \
+                    and time.monotonic() - page_started < target_page_seconds:
+                page_size = min(page_size * 2, max_page_size)
+                if debug_enabled:
+                    logger.debug("Increasing page_size to %d", page_size)
+    
+    def get_all_data_paginated_parallel(self, bucket_name: str, page_size: int = 1000,
+                                        concurrency: int = 4, select_fields: str = "meta().id,*",
+                                        where_clause: str = None, order_by: str = None,
+                                        max_records: int = None, debug: bool = False,
+                                        max_retries: int = 3, retry_delay: int = 2,
+                                        ordered: bool = False):
+        """
+        Generator function to fetch all data from bucket with several pages in flight.
+        Pages are requested by offset in a sliding window of `concurrency` pages on the shared
+        cluster and yielded in completion order, or in offset order when ordered=True.
+        Failed pages are skipped, like get_all_data_paginated.
+        
+        Args:
+            bucket_name: Name of the bucket
+            page_size: Number of records per page (default: 1000)
+            concurrency: Maximum number of pages fetched at the same time (default: 4)
+            select_fields: Fields to select (default: "meta().id,*")
+            where_clause: Optional WHERE clause (without WHERE keyword)
+            order_by: Optional ORDER BY clause (default: meta().id so pages never overlap)
+            max_records: Maximum total records to fetch (None = all records)
+            debug: If True, print debug information
+            max_retries: Maximum number of retry attempts (default: 3)
+            retry_delay: Delay in seconds between retries (default: 2)
+            ordered: If True, buffer completed pages and yield them in offset order. At most
+                     2 * concurrency pages are buffered ahead of the oldest unfinished page.
+            
+        Yields:
+            tuple: (offset, list) - Offset and list of dictionaries for each page
+        """
+        order_by = order_by or "meta().id"
+        query = self._build_page_query(bucket_name, select_fields, where_clause, order_by)
+        next_offset = 0
+        reached_end = False
+        total_fetched = 0
+        failed_offsets = []
+        in_flight = {}
+        completed_pages = {}  # offset -> page, only used when ordered
+        next_yield_offset = 0
+        max_ahead = 2 * concurrency * page_size
+        
+        # Open the cluster once before the workers share it
+        self.connect()
+        logger.info(f"Starting parallel paginated fetch from bucket: {bucket_name} "
+                    f"(page_size: {page_size}, concurrency: {concurrency})")
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            def submit_next_page():
+                nonlocal next_offset
+                future = executor.submit(
+                    self.get_data_paginated,
+                    bucket_name=bucket_name,
+                    page_size=page_size,
+                    offset=next_offset,
+                    select_fields=select_fields,
+                    where_clause=where_clause,
+                    order_by=order_by,
+                    debug=debug,
+                    max_retries=max_retries,
+                    retry_delay=retry_delay,
+                    raise_on_error=True,
+                    query=query
+                )
+                in_flight[future] = next_offset
+                next_offset += page_size
+            
+            def fill_window():
+                while not reached_end and len(in_flight) < concurrency:
+                    if max_records and next_offset >= max_records:
+                        break
+                    # Ordered mode: do not run too far ahead of a slow page
+                    if ordered and next_offset - next_yield_offset >= max_ahead:
+                        break
+                    submit_next_page()
+            
+            fill_window()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset = in_flight.pop(future)
+                    try:
+                        page_data = future.result()
+                    except Exception:
+                        # Already logged by get_data_paginated; skip the page
+                        failed_offsets.append(offset)
+                        page_data = None
+                    
+                    if page_data is not None and len(page_data) < page_size:
+                        reached_end = True
+                    if page_data:
+                        total_fetched += len(page_data)
+                    
+                    if not ordered:
+                        if page_data:
+                            yield (offset, page_data)
+                        continue
+                    completed_pages[offset] = page_data
+                    while next_yield_offset in completed_pages:
+                        ready_page = completed_pages.pop(next_yield_offset)
+                        if ready_page:
+                            yield (next_yield_offset, ready_page)
+                        next_yield_offset += page_size
+                
+                fill_window()
+        
+        logger.info(f"Reached end of data. Total fetched: {total_fetched}")
+        if failed_offsets:
+            logger.warning(f"Skipped {len(failed_offsets)} failed pages at offsets: {sorted(failed_offsets)[:10]}")
+    
+    def _get_partition_bounds(self, bucket_name: str, partitions: int, total_count: int,
+                              where_clause: str = None):
+        """
+        Find document ids splitting the bucket into `partitions` ranges of similar size.
+        Each bound is the id at offset k * total_count / partitions in meta().id order,
+        read from the primary index with a one-row query.
+        Returns: sorted list of distinct ids (at most partitions - 1)
+        """
+        query = f"SELECT RAW meta().id FROM `{bucket_name}`"
+        if where_clause:
+            query += f" WHERE {where_clause}"
+        query += " ORDER BY meta().id OFFSET $offset LIMIT 1"
+        
+        cluster = self.connect()
+        bounds = []
+        for k in range(1, partitions):
+            query_options = QueryOptions(client_context_id=_next_context_id(), adhoc=False,
+                                         named_parameters={'offset': k * total_count // partitions})
+            bound = next(iter(cluster.query(query, query_options).rows()), None)
+            if bound is not None and (not bounds or bound > bounds[-1]):
+                bounds.append(bound)
+        return bounds
+    
+    def get_all_data_partitioned(self, bucket_name: str, page_size: int = 1000,
+                                 partitions: int = 8, select_fields: str = "meta().id,*",
+                                 where_clause: str = None, max_records: int = None,
+                                 debug: bool = False, max_retries: int = 3,
+                                 retry_delay: int = 2, ordered: bool = False, total_count: int = None):
+        """
+        Generator function to fetch all data from bucket with one keyset scan per id range.
+        The meta().id space is split into `partitions` ranges of similar size, and each range is
+        scanned by get_all_data_paginated in its own thread, so the server works on several
+        ranges at once and no page pays for an OFFSET. Requires meta().id in select_fields.
+        
+        Args:
+            bucket_name: Name of the bucket
+            page_size: Number of records per page (default: 1000)
+            partitions: Number of id ranges scanned at the same time (default: 8)
+            select_fields: Fields to select (default: "meta().id,*")
+            where_clause: Optional WHERE clause (without WHERE keyword)
+            max_records: Maximum total records to fetch (None = all records)
+            debug: If True, print debug information
+            max_retries: Maximum number of retry attempts (default: 3)
+            retry_delay: Delay in seconds between retries (default: 2)
+            ordered: If True, yield pages in meta().id order (range by range); faster ranges
+                     wait once `partitions` of their pages are buffered. Otherwise pages are
+                     yielded as they arrive.
+            total_count: Number of documents matching where_clause, if the caller already counted
+                         them (saves a full COUNT scan); counted here otherwise
+            
+        Yields:
+            tuple: (offset, list) - Approximate offset of the page in the bucket and list of dictionaries
+        Raises:
+            RuntimeError once every range is done, if some range could not be scanned to its end
+            (the pages fetched before the failure were yielded)
+        """
+        if total_count is None:
+            total_count = self.get_total_count(bucket_name, where_clause)
+        partitions = max(1, min(partitions, -(-total_count // page_size)))
+        bounds = self._get_partition_bounds(bucket_name, partitions, total_count, where_clause)
+        lower_bounds = [None] + bounds
+        upper_bounds = bounds + [None]
+        partitions = len(lower_bounds)
+        
+        logger.info(f"Starting partitioned fetch from bucket: {bucket_name} "
+                    f"(page_size: {page_size}, partitions: {partitions})")
+        
+        stop = threading.Event()
+        # One bounded queue per range keeps ordered output simple; unordered output shares one
+        queues = [queue.Queue(maxsize=partitions) for _ in range(partitions if ordered else 1)]
+        done = object()
+        
+        def put(page_queue, item):
+            while not stop.is_set():
+                try:
+                    page_queue.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def scan_range(partition):
+            page_queue = queues[partition if ordered else 0]
+            conditions = [f"({where_clause})"] if where_clause else []
+            if lower_bounds[partition] is not None:
+                conditions.append(f"meta().id >= {json_dumps(lower_bounds[partition])}")
+            if upper_bounds[partition] is not None:
+                conditions.append(f"meta().id < {json_dumps(upper_bounds[partition])}")
+            start_offset = partition * total_count // partitions
+            try:
+                for offset, page_data in self.get_all_data_paginated(
+                        bucket_name=bucket_name,
+                        page_size=page_size,
+                        select_fields=select_fields,
+                        where_clause=" AND ".join(conditions) or None,
+                        debug=debug,
+                        max_retries=max_retries,
+                        retry_delay=retry_delay):
+                    if not put(page_queue, (start_offset + offset, page_data)):
+                        return
+            except Exception as e:
+                logger.error(f"Error scanning partition {partition} of bucket {bucket_name}: {e}", exc_info=True)
+                # Reported to the consumer: the rest of this range is missing
+                put(page_queue, e)
+            finally:
+                put(page_queue, done)
+        
+        total_fetched = 0
+        errors = []
+        executor = ThreadPoolExecutor(max_workers=partitions)
+        try:
+            for partition in range(partitions):
+                executor.submit(scan_range, partition)
+            
+            if ordered:
+                sources = [(queues[partition], 1) for partition in range(partitions)]
+            else:
+                sources = [(queues[0], partitions)]
+            for page_queue, producers in sources:
+                while producers:
+                    item = page_queue.get()
+                    if item is done:
+                        producers -= 1
+                        continue
+                    if isinstance(item, Exception):
+                        errors.append(item)
+                        continue
+                    total_fetched += len(item[1])
+                    yield item
+                    if max_records and total_fetched >= max_records:
+                        logger.info(f"Reached max_records limit: {max_records}")
+                        return
+            if errors:
+                raise RuntimeError(f"{len(errors)}/{partitions} id ranges of bucket {bucket_name} could not be "
+                                   f"scanned to the end: {errors[0]}") from errors[0]
+        finally:
+            # Also reached when the caller stops iterating: release blocked workers
+            stop.set()
+            executor.shutdown(wait=True)
+            logger.info(f"Partitioned fetch finished. Total fetched: {total_fetched}")
     
-    def get_total_count(self, bucket_name: str, where_clause: str = None):
+    def get_total_count(self, bucket_name: str, where_clause: str = None, adhoc: bool = True):
         """
         Get total count of documents in bucket.
         
         Args:
             bucket_name: Name of the bucket
             where_clause: Optional WHERE clause (without WHERE keyword)
+            adhoc: If False, the SDK prepares the statement once and reuses the cached plan;
+                   worth it for callers that repeat the same count (e.g. load tests)
             
         Returns:
             int: Total count of documents
         """
         try:
-            query = f"SELECT COUNT(*) as count FROM `{bucket_name}` USE INDEX(`#primary`)"
+            # No USE INDEX hint: without a WHERE clause the query service answers COUNT(*)
+            # from bucket stats, and with one it can pick a covering secondary index
+            query = f"SELECT COUNT(*) as count FROM `{bucket_name}`"
             if where_clause:
                 query += f" WHERE {where_clause}"
             
             cluster = self.connect()
-            query_options = QueryOptions(client_context_id=str(uuid.uuid4()))
+            query_options = QueryOptions(client_context_id=_next_context_id(), adhoc=adhoc)
             result = cluster.query(query, query_options)
             
-            # Check for errors in result metadata
-            if hasattr(result, 'metadata') and hasattr(result.metadata, 'warnings'):
-                warnings = result.metadata.warnings
-                if warnings:
-                    logger.warning(f"Query warnings for bucket {bucket_name}: {warnings}")
-            
-            row_count = 0
-            for row in result.rows():
-                row_count += 1
-                if isinstance(row, dict):
-                    count_value = row.get('count', 0)
-                    logger.debug(f"Count result for bucket {bucket_name}: {count_value}")
-                    return count_value
-                else:
-                    try:
-                        row_dict = dict(row)
-                        count_value = row_dict.get('count', 0)
-                        logger.debug(f"Count result for bucket {bucket_name}: {count_value}")
-                        return count_value
-                    except Exception as dict_err:
-                        logger.debug(f"Error converting row to dict: {dict_err}")
-                        if hasattr(row, 'count'):
-                            count_value = row.count
-                            return count_value
-                        # Try accessing as dict-like
-                        try:
-                            count_value = row['count']
-                            return count_value
-                        except:
-                            pass
-            
-            if row_count == 0:
+            # COUNT(*) returns exactly one row
+            row = next(iter(result.rows()), None)
+            if row is None:
                 logger.warning(f"No rows returned from count query for bucket {bucket_name}")
+                return 0
             
-            return 0
+            count_value = row['count']
+            logger.debug("Count result for bucket %s: %s", bucket_name, count_value)
+            return count_value
         except CouchbaseException as e:
             error_msg = str(e).lower()
             logger.error(f"Error getting total count for bucket {bucket_name}: {e}", exc_info=True)
@@ -633,9 +1201,6 @@ class CouchbaseDataAccess:
         except Exception as e:
             logger.error(f"Unexpected error getting total count for bucket {bucket_name}: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
     
     def check_bucket_exists(self, bucket_name: str):
         """
@@ -666,9 +1231,6 @@ class CouchbaseDataAccess:
         except Exception as e:
             logger.warning(f"Unexpected error checking bucket {bucket_name}: {e}")
             return False
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
     
     def create_bucket(self, bucket_name: str, ram_quota_mb: int = 100, 
                      bucket_type: BucketType = BucketType.COUCHBASE, 
@@ -692,13 +1254,14 @@ class CouchbaseDataAccess:
             cluster = self.connect()
             bucket_manager = cluster.buckets()
             
-            # Check if bucket already exists
+            # Check if bucket already exists (one targeted lookup instead of listing every bucket)
             try:
-                existing_buckets = bucket_manager.get_all_buckets()
-                bucket_names = [bucket.name for bucket in existing_buckets]
-                if bucket_name in bucket_names:
-                    logger.info(f"Bucket '{bucket_name}' already exists")
-                    return True
+                bucket_manager.get_bucket(bucket_name)
+                logger.info(f"Bucket '{bucket_name}' already exists")
+                return True
+            except BucketDoesNotExistException:
+                # What BucketManager.get_bucket raises for a missing bucket (not BucketNotFoundException)
+                pass
             except Exception as e:
                 logger.warning(f"Could not check existing buckets: {e}, proceeding with creation")
             
@@ -718,18 +1281,21 @@ class CouchbaseDataAccess:
             # Wait for bucket to be ready
             if wait_ready:
                 logger.info(f"Waiting for bucket '{bucket_name}' to be ready...")
-                elapsed = 0
-                while elapsed < wait_timeout:
+                # Poll the bucket manager with exponential backoff (50ms doubling up to 1s)
+                started = time.monotonic()
+                deadline = started + wait_timeout
+                delay = 0.05
+                while time.monotonic() < deadline:
                     try:
-                        if self.check_bucket_exists(bucket_name):
-                            logger.info(f"Bucket '{bucket_name}' is now ready")
-                            return True
-                    except Exception:
+                        bucket_manager.get_bucket(bucket_name)
+                        logger.info(f"Bucket '{bucket_name}' is now ready")
+                        return True
+                    except CouchbaseException:
                         pass
-                    time.sleep(1)
-                    elapsed += 1
-                    if elapsed % 5 == 0:
-                        logger.debug(f"Still waiting for bucket '{bucket_name}' to be ready... ({elapsed}s/{wait_timeout}s)")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 1.0)
+                    logger.debug("Still waiting for bucket '%s' to be ready... (%.1fs/%ss)",
+                                 bucket_name, time.monotonic() - started, wait_timeout)
                 
                 logger.warning(f"Timeout waiting for bucket '{bucket_name}' to be ready after {wait_timeout} seconds")
                 # Check one more time
@@ -749,9 +1315,6 @@ class CouchbaseDataAccess:
         except Exception as e:
             logger.error(f"Unexpected error creating bucket '{bucket_name}': {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
     
     def upsert_document(self, bucket_name: str, document_id: str, document: dict):
         """
@@ -763,167 +1326,116 @@ class CouchbaseDataAccess:
             document: Document data as dictionary
         """
         try:
-            cluster = self.connect()
-            if not self.bucket or self.bucket.name != bucket_name:
-                self.bucket = cluster.bucket(bucket_name)
-            
-            collection = self.bucket.default_collection()
+            collection = self._get_collection(bucket_name)
             collection.upsert(document_id, document)
-            logger.debug(f"Upserted document {document_id} into bucket {bucket_name}")
+            logger.debug("Upserted document %s into bucket %s", document_id, bucket_name)
         except CouchbaseException as e:
             logger.error(f"Error upserting document {document_id} into bucket {bucket_name}: {e}", exc_info=True)
             raise e
         except Exception as e:
             logger.error(f"Unexpected error upserting document: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
     
-    def upsert_documents(self, bucket_name: str, documents: list, batch_size: int = 100,
-                        max_retries: int = 3, retry_delay: int = 2):
+    def _upsert_batch(self, collection, batch_docs: dict, max_retries: int, retry_delay: int):
+        """
+        Upsert {doc_id: content} with one pipelined upsert_multi, retrying only the keys that failed.
+        Returns: (upserted, failed) counts
+        """
+        pending = batch_docs
+        failed = {}
+        upserted = 0
+        for attempt in range(max_retries):
+            try:
+                failed = collection.upsert_multi(pending).exceptions
+            except CouchbaseException as e:
+                failed = dict.fromkeys(pending, e)
+            upserted += len(pending) - len(failed)
+            if not failed:
+                break
+            pending = {doc_id: pending[doc_id] for doc_id in failed}
+            if attempt < max_retries - 1:
+                wait_time = retry_delay * (attempt + 1)  # Exponential backoff
+                logger.warning(
+                    f"Timeout/Error upserting {len(pending)} documents "
+                    f"(attempt {attempt + 1}/{max_retries}). "
+                    f"Retrying in {wait_time} seconds... Error: {type(next(iter(failed.values()))).__name__}"
+                )
+                time.sleep(wait_time)
+        
+        for doc_id, last_error in failed.items():
+            logger.error(
+                f"Skipping document '{doc_id}' after {max_retries} failed attempts. "
+                f"Last error: {type(last_error).__name__}: {last_error}"
+            )
+        return upserted, len(failed)
+    
+    def upsert_documents(self, bucket_name: str, documents: list, batch_size: int = None,
+                        max_retries: int = 3, retry_delay: int = 2, processes: int = None):
         """
         Upsert multiple documents into Couchbase bucket.
         
         Args:
             bucket_name: Name of the bucket
-            documents: List of dictionaries. Expected structure:
+            documents: List (or any iterable) of dictionaries. Expected structure:
                       - document["id"] is the document ID in bucket
                       - document[bucket_name] is the document value
                       - If value is not a dict, will try to convert it to dict
-            batch_size: Number of documents to process in each batch (default: 100)
+            batch_size: Number of documents to process in each batch (default: config upsert_batch_size,
+                        CB_UPSERT_BATCH_SIZE), lowered so that a batch stays under 16 MiB
             max_retries: Maximum number of retries for failed upserts (default: 3)
             retry_delay: Delay in seconds between retries (default: 2)
+            processes: If greater than 1, normalize batch_size chunks in that many worker processes
+                       (worth it when many values are JSON strings to parse; default: None)
         """
+        if batch_size is None:
+            batch_size = self.config.upsert_batch_size
         try:
-            cluster = self.connect()
-            if not self.bucket or self.bucket.name != bucket_name:
-                try:
-                    self.bucket = cluster.bucket(bucket_name)
-                except BucketNotFoundException:
-                    error_msg = (
-                        f"Bucket '{bucket_name}' not found in Couchbase cluster.\n"
-                        f"Please create the bucket first using Couchbase Admin UI or REST API.\n"
-                        f"To create bucket via REST API:\n"
-                        f"  curl -X POST http://{self.config.host}:8091/pools/default/buckets \\\n"
-                        f"    -u {self.config.user}:{self.config.password} \\\n"
-                        f"    -d name={bucket_name} \\\n"
-                        f"    -d bucketType=couchbase \\\n"
-                        f"    -d ramQuotaMB=100"
-                    )
-                    logger.error(error_msg)
-                    raise BucketNotFoundException(f"Bucket '{bucket_name}' not found. Please create it first.")
+            try:
+                collection = self._get_collection(bucket_name)
+            except BucketNotFoundException:
+                error_msg = (
+                    f"Bucket '{bucket_name}' not found in Couchbase cluster.\n"
+                    f"Please create the bucket first using Couchbase Admin UI or REST API.\n"
+                    f"To create bucket via REST API:\n"
+                    f"  curl -X POST http://{self.config.host}:8091/pools/default/buckets \\\n"
+                    f"    -u {self.config.user}:{self.config.password} \\\n"
+                    f"    -d name={bucket_name} \\\n"
+                    f"    -d bucketType=couchbase \\\n"
+                    f"    -d ramQuotaMB=100"
+                )
+                logger.error(error_msg)
+                raise BucketNotFoundException(f"Bucket '{bucket_name}' not found. Please create it first.")
             
-            collection = self.bucket.default_collection()
             total_upserted = 0
             skipped = 0
             
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i:i+batch_size]
-                for doc in batch:
-                    try:
-                        if not isinstance(doc, dict):
-                            skipped += 1
-                            logger.warning(f"Skipping non-dict document: {type(doc)}")
-                            continue
-                        
-                        # Extract document ID from document["id"]
-                        doc_id = doc.get('id')
-                        if not doc_id:
-                            # Fallback: try other common ID fields
-                            doc_id = doc.get('_id') or doc.get('key')
-                            if not doc_id:
-                                skipped += 1
-                                logger.warning(f"Skipping document without ID: {doc}")
-                                continue
-                        
-                        # Get document value from document[bucket_name]
-                        doc_value = doc.get(bucket_name)
-                        
-                        # If bucket_name field doesn't exist, try 'value' field as fallback
-                        if doc_value is None:
-                            doc_value = doc.get('value')
-                        
-                        # If still no value, use the entire doc (excluding id fields)
-                        if doc_value is None:
-                            doc_value = {k: v for k, v in doc.items() if k not in ['id', '_id', 'key']}
-                            if not doc_value:
-                                skipped += 1
-                                logger.warning(f"Skipping document with no value: {doc_id}")
-                                continue
-                        
-                        # Convert value to dict if needed
-                        if isinstance(doc_value, dict):
-                            doc_content = doc_value.copy()
-                        elif isinstance(doc_value, str):
-                            # Try to parse string as JSON
-                            try:
-                                doc_content = json.loads(doc_value)
-                                if not isinstance(doc_content, dict):
-                                    # If parsed result is not a dict, wrap it
-                                    doc_content = {"value": doc_content}
-                            except (json.JSONDecodeError, ValueError):
-                                # If not valid JSON, wrap the string as dict
-                                doc_content = {"value": doc_value}
-                        else:
-                            # For other types (list, number, etc.), wrap in dict
-                            doc_content = {"value": doc_value}
-                        
-                        # Ensure doc_content is a dict
-                        if not isinstance(doc_content, dict):
-                            doc_content = {"value": doc_content}
-                        
-                        # Upsert document with retry logic
-                        upsert_success = False
-                        last_error = None
-                        for attempt in range(max_retries):
-                            try:
-                                collection.upsert(doc_id, doc_content)
-                                total_upserted += 1
-                                upsert_success = True
-                                break
-                            except (AmbiguousTimeoutException, CouchbaseException) as e:
-                                last_error = e
-                                if attempt < max_retries - 1:
-                                    wait_time = retry_delay * (attempt + 1)  # Exponential backoff
-                                    logger.warning(
-                                        f"Timeout/Error upserting document '{doc_id}' "
-                                        f"(attempt {attempt + 1}/{max_retries}). "
-                                        f"Retrying in {wait_time} seconds... Error: {type(e).__name__}"
-                                    )
-                                    time.sleep(wait_time)
-                                    # Reconnect if needed (timeout might indicate connection issue)
-                                    try:
-                                        if not self.bucket or self.bucket.name != bucket_name:
-                                            self.bucket = cluster.bucket(bucket_name)
-                                        collection = self.bucket.default_collection()
-                                    except Exception as reconnect_err:
-                                        logger.warning(f"Error reconnecting: {reconnect_err}")
-                                else:
-                                    # Last attempt failed
-                                    logger.error(
-                                        f"Failed to upsert document '{doc_id}' after {max_retries} attempts. "
-                                        f"Error: {type(e).__name__}: {e}"
-                                    )
-                            except Exception as e:
-                                # Non-retryable errors
-                                last_error = e
-                                logger.error(f"Non-retryable error upserting document '{doc_id}': {e}")
-                                break
-                        
-                        if not upsert_success:
-                            skipped += 1
-                            logger.error(
-                                f"Skipping document '{doc_id}' after {max_retries} failed attempts. "
-                                f"Last error: {last_error}"
-                            )
-                        
-                    except Exception as e:
-                        skipped += 1
-                        logger.error(f"Error processing document (ID: {doc.get('id', 'unknown')}): {e}", exc_info=True)
+            # Validate and normalize documents chunk by chunk, right before each chunk is upserted
+            # (or in worker processes while this thread upserts the chunks already normalized),
+            # so a generator input is never held in memory as a whole
+            executor = None
+            if processes and processes > 1:
+                executor = ProcessPoolExecutor(max_workers=processes)
+                normalized_chunks = _map_bounded(executor, _normalize_docs, chunked(documents, batch_size),
+                                                 processes * 2, bucket_name)
+            else:
+                normalized_chunks = (_normalize_docs(chunk, bucket_name) for chunk in chunked(documents, batch_size))
+            
+            try:
+                for normalized, invalid in normalized_chunks:
+                    skipped += len(invalid)
+                    for message in invalid:
+                        logger.warning(*message)
+                    if not normalized:
                         continue
-                
-                logger.debug(f"Upserted batch: {total_upserted} documents, skipped: {skipped}")
+                    
+                    for batch in chunked(normalized, cap_batch_size(normalized[0][1], batch_size)):
+                        upserted, failed = self._upsert_batch(collection, dict(batch), max_retries, retry_delay)
+                        total_upserted += upserted
+                        skipped += failed
+                        logger.debug("Upserted batch: %d documents, skipped: %d", total_upserted, skipped)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
             
             logger.info(f"Upserted {total_upserted} documents into bucket {bucket_name}, skipped {skipped}")
             return total_upserted
@@ -935,7 +1447,4 @@ class CouchbaseDataAccess:
             raise e
         except Exception as e:
             logger.error(f"Unexpected error upserting documents: {e}", exc_info=True)
-            raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
\ No newline at end of file
+            raise e
\ No newline at end of file
@@ -1,44 +1,67 @@
 
-import os
-import sys
-import gc
-
-from pymongo.common import MAX_IDLE_TIME_MS
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import atexit
+import heapq
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, count, repeat
 
+import certifi
 from config import MongoDBConfig
-from pymongo import MongoClient
-from pymongo.database import Database
+from pymongo import InsertOne, MongoClient
+from pymongo.write_concern import WriteConcern
 from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError, ServerSelectionTimeoutError
 
 from logger_config import get_logger
+from utils import cap_batch_size, chunked, json_size
 logger = get_logger(__name__)
 
+# CA bundle path is constant for the process: resolve it once instead of on every connect()
+_CERTIFI_CA = certifi.where()
+
+# Ingestion write concerns selectable in add_documents (see its docstring for the durability tradeoff)
+_WRITE_CONCERNS = {
+    "fast": WriteConcern(w=1, j=False),
+    "unacknowledged": WriteConcern(w=0),
+}
+
+# Error messages treated as SSL/connection failures by add_documents' retry logging
+_SSL_RE = re.compile(
+    r"ssl|eof occurred in violation of protocol|connection reset|broken pipe|connection aborted|time out",
+    re.IGNORECASE
+)
+
 class MongoDBDataAccess:
 
+    # MongoClient is thread-safe and pools its connections: one client per
+    # (connection string, tls) is shared by every DAL in the process
+    _clients = {}
+    _clients_lock = threading.Lock()
+
     def __init__(self, config: MongoDBConfig):
         self.config = config
         self.client = None
         self.database = None
+        self._tls_enabled = config.tls == "true"
 
     def connect(self):
+        """
+        Connect to MongoDB. The shared client for this connection string is created on
+        first use and reused by every DAL instance until shutdown() is called.
+        """
+        if self.client is not None:
+            return self.client
         try:
-            connection_string = self.config.connection_string
-            if self.config.tls == "true":
-                import certifi as cert
-                self.client = MongoClient(
-                    connection_string, 
-                    tls=True, 
-                    tlsCAFile= cert.where(), 
-                    serverSelectionTimeoutMS=30000, 
-                    maxIdleTimeMS=120000
-                )
-            else:
-                self.client = MongoClient(
-                    connection_string, 
-                    serverSelectionTimeoutMS=30000, 
-                    maxIdleTimeMS=120000
-                )
+            client_key = (self.config.connection_string, self._tls_enabled)
+            with MongoDBDataAccess._clients_lock:
+                client = MongoDBDataAccess._clients.get(client_key)
+                if client is None:
+                    client = self._create_client()
+                    MongoDBDataAccess._clients[client_key] = client
+            self.client = client
             self.database = self.client[self.config.database]
             return self.client
         except ConnectionFailure as e:
@@ -48,13 +71,49 @@ class MongoDBDataAccess:
             logger.error(f"Unexpected error connecting to MongoDB: {e}", exc_info=True)
             raise e
 
+    def client_options(self) -> dict:
+        """
+        Keyword arguments for the MongoClient of this config (also accepted by AsyncMongoClient).
+        """
+        options = {'serverSelectionTimeoutMS': 30000, 'maxIdleTimeMS': 120000}
+        if self._tls_enabled:
+            options.update(tls=True, tlsCAFile=_CERTIFI_CA)
+        # Compressors the driver cannot load (e.g. zstandard not installed) are skipped with a warning
+        if self.config.compressors:
+            options.update(compressors=self.config.compressors, zlibCompressionLevel=3)
+        return options
+
+    def _create_client(self):
+        return MongoClient(self.config.connection_string, **self.client_options())
+
     def close(self):
-        if self.client:
-            self.client.close()
-            self.client = None
-            # Removed gc.collect() to prevent debugger hang
+        """
+        Release this DAL's reference to the shared client. The client keeps its pooled
+        connections for other DAL instances; shutdown() closes it at process exit.
+        """
+        self.client = None
+        self.database = None
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Close every shared MongoClient. Registered with atexit.
+        """
+        with cls._clients_lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+        for client in clients:
+            client.close()
+        if clients:
             logger.info("Closed MongoDB connection")
 
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     
     def add_document(self, collection_name: str, document: dict):
         try:
@@ -66,30 +125,69 @@ class MongoDBDataAccess:
         except Exception as e:
             logger.error(f"Unexpected error adding document to MongoDB: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
-    def add_documents(self, collection_name: str, documents: list, max_retries: int = 5, retry_delay: int = 3):
-        import time
+    def add_documents(self, collection_name: str, documents: list, max_retries: int = 5, retry_delay: int = 3,
+                      batch_size: int = None, write_concern: str = "default"):
+        """
+        Insert documents with an unordered bulk_write, batch_size documents per request.
+        
+        Args:
+            collection_name: Name of the collection
+            documents: List (or any iterable) of documents to insert
+            max_retries: Maximum number of attempts per batch (default: 5)
+            retry_delay: Base delay in seconds between retries, doubled on each attempt (default: 3)
+            batch_size: Documents per bulk_write (default: config insert_batch_size),
+                        lowered so that a batch stays under 16 MiB
+            write_concern: "default" uses the client's write concern (usually majority, durable);
+                           "fast" waits for the primary only, without journaling (w=1, j=False), so
+                           acknowledged writes can be lost on a primary crash or failover;
+                           "unacknowledged" does not wait at all (w=0): no errors are reported, so
+                           duplicates are neither re-inserted nor logged
+        """
+        if batch_size is None:
+            batch_size = self.config.insert_batch_size
+        documents = iter(documents)
+        first = next(documents, None)
+        if first is None:
+            return
+        batch_size = cap_batch_size(first, batch_size)
+        for batch in chunked(chain((first,), documents), batch_size):
+            self._insert_batch(collection_name, batch, max_retries, retry_delay, write_concern)
+
+    def _get_collection(self, collection_name: str, write_concern: str = "default"):
+        collection = self.database[collection_name]
+        if write_concern != "default":
+            collection = collection.with_options(write_concern=_WRITE_CONCERNS[write_concern])
+        return collection
+
+    def _insert_batch(self, collection_name: str, documents: list, max_retries: int, retry_delay: int,
+                      write_concern: str = "default", resent: bool = False):
+        """
+        Insert one batch, retrying connection errors. resent=True means the batch was already
+        sent by an earlier call (the buffered writer's retries), like attempts after the first here.
+        
+        Returns:
+            list: Indexes (in documents) of the documents that could not be inserted, even re-inserted
+        """
         last_error = None
+        # Built once and reused by every attempt
+        operations = [InsertOne(document) for document in documents]
         for attempt in range(max_retries):
             try:
-                self.close() # close previous connection since retry
                 self.connect()
-                self.database[collection_name].insert_many(documents, ordered=False)
-                return
+                collection = self._get_collection(collection_name, write_concern)
+                collection.bulk_write(operations, ordered=False)
+                return []
             except BulkWriteError as bwe:
+                # Every other document is written: re-insert only the failed ones
                 write_errors = bwe.details.get('writeErrors', [])
-                failed_indexes = {err['index'] for err in write_errors}
-                for i in failed_indexes:
-                    retry_doc = documents[i].copy()
-                    retry_doc.pop("_id", None)
-                    try:
-                        self.database[collection_name].insert_one(retry_doc)
-                    except PyMongoError as e:
-                        logger.error(f"FAILE_DOCUMENT_INSERT: {collection_name}|{documents[i]}|Error:{e}", exc_info=True)
-                        continue
+                if attempt > 0 or resent:
+                    # InsertOne set each _id on the first send: a duplicate key now is a document
+                    # an earlier, interrupted attempt already wrote, not one to store again
+                    write_errors = [err for err in write_errors if err.get('code') != 11000]
+                if not write_errors:
+                    return []
+                return self._reinsert_failed(collection, documents, sorted({err['index'] for err in write_errors}))
                 
                 # duplicate_errors = [error for error in write_errors if error.get('code') == 11000]
                 # if duplicate_errors:
@@ -116,6 +214,7 @@ class MongoDBDataAccess:
                 if attempt < max_retries - 1:
                     delay = retry_delay * (2**attempt)
                     logger.info(f"Retrying in {delay} seconds...")
+                    # The shared client drops broken pooled sockets itself; the next attempt reuses it
                     time.sleep(delay)
                 else:
                     logger.error(f"=" * 90)
@@ -129,18 +228,43 @@ class MongoDBDataAccess:
                 last_error = e
                 logger.error(f"Unexpected error adding documents to MongoDB: {e}", exc_info=True)
                 raise e
-            finally:
-                if attempt < max_retries - 1 or last_error:
-                    self.close()
-                # Removed gc.collect() to prevent debugger hang
+
+    def _reinsert_failed(self, collection, documents: list, failed_indexes: list):
+        """
+        Insert the documents that failed in a bulk write again without their _id
+        (so duplicates get a new ObjectId), in one unordered bulk_write.
+        Returns: indexes (in documents) of the documents that failed again
+        """
+        retry_docs = []
+        for i in failed_indexes:
+            retry_doc = documents[i].copy()
+            retry_doc.pop("_id", None)
+            retry_docs.append(retry_doc)
+        collection_name = collection.name
+        try:
+            collection.bulk_write([InsertOne(doc) for doc in retry_docs], ordered=False)
+            return []
+        except BulkWriteError as bwe:
+            still_failed = []
+            for err in bwe.details.get('writeErrors', []):
+                still_failed.append(failed_indexes[err['index']])
+                logger.error(f"FAILE_DOCUMENT_INSERT: {collection_name}|{documents[failed_indexes[err['index']]]}|"
+                             f"Error:{err.get('errmsg')}")
+            return still_failed
+        except PyMongoError as e:
+            for i in failed_indexes:
+                logger.error(f"FAILE_DOCUMENT_INSERT: {collection_name}|{documents[i]}|Error:{e}")
+            return list(failed_indexes)
 
     def drop_collections(self):
         try:
             self.connect()
             collection_names = self.database.list_collection_names()
-            for collection in collection_names:
-                # if collection.startswith("rms_"):
-                self.database[collection].drop()
+            # Drops are independent commands: run them concurrently on the shared pool
+            # if collection.startswith("rms_"):
+            if collection_names:
+                with ThreadPoolExecutor(max_workers=min(32, len(collection_names))) as executor:
+                    list(executor.map(lambda collection: self.database[collection].drop(), collection_names))
             logger.info(f"Successfully dropped {len(collection_names)} collections from MongoDB")
         except PyMongoError as e:
             logger.error(f"Error dropping collection from MongoDB: {e}", exc_info=True)
@@ -148,21 +272,9 @@ class MongoDBDataAccess:
         except Exception as e:
             logger.error(f"Unexpected error dropping collection from MongoDB: {e}", exc_info=True)
             raise e
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
 
     def _is_ssl_error(self, error):
-        error_str = str(error).lower()
-        ssl_indicators = [
-            "ssl",
-            "eof occurred in violation of protocol",
-            "connection reset",
-            "broken pipe",
-            "connection aborted",
-            "time out"
-        ]
-        return any(indicator in error_str for indicator in ssl_indicators)
+        return _SSL_RE.search(str(error)) is not None
 
     def document_exists(self, collection_name: str, document_id: str):
         """
@@ -185,6 +297,234 @@ class MongoDBDataAccess:
         except Exception as e:
             logger.error(f"Unexpected error checking document existence: {e}", exc_info=True)
             return False
-        finally:
-            self.close()
-            # Removed gc.collect() to prevent debugger hang
\ No newline at end of file
+
+
+class _PendingWrite:
+    """
+    Completion of one BufferedMongoDBDataAccess.add_documents call, whose documents may be
+    written in several batches (and retried) together with other calls' documents.
+    """
+    __slots__ = ('future', 'count', 'remaining', 'failed', 'error')
+
+    def __init__(self, count: int):
+        self.future = Future()
+        self.count = count
+        self.remaining = count
+        self.failed = 0
+        self.error = None
+
+
+class BufferedMongoDBDataAccess(MongoDBDataAccess):
+    """
+    MongoDBDataAccess whose add_documents only buffers the documents: a background writer
+    thread inserts them in larger unordered batches, merging documents from many calls
+    (e.g. many migrated pages) into one bulk_write.
+    
+    A collection's buffer is written once it holds max_docs documents or about max_bytes,
+    or when its oldest document has waited flush_interval seconds. One instance is meant to be
+    shared by every thread writing to the same database. add_documents returns a Future that
+    tells the caller when its documents are written or failed; flush() writes buffered
+    collections right away and stop() ends the writer.
+    
+    A bulk_write that fails is not retried in place: the batch is scheduled again after an
+    exponential backoff with jitter, and the writer keeps writing the other batches meanwhile.
+    """
+
+    def __init__(self, config: MongoDBConfig, max_docs: int = 5000, max_bytes: int = 12 * 1024 * 1024,
+                 flush_interval: float = 1.0, max_retries: int = 5, retry_delay: int = 3,
+                 write_concern: str = "default"):
+        super().__init__(config)
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.write_concern = write_concern
+        self.failed_counts = {}  # collection name -> documents whose batch could not be written
+        # collection name -> [documents, their _PendingWrite (one per document), estimated bytes,
+        # monotonic time of the first one]
+        self._buffers = {}
+        self._pending = {}  # collection name -> documents buffered or being written
+        self._force = set()  # collections flush() is waiting for
+        # heap of (due monotonic time, sequence, collection name, documents, owners, attempt)
+        self._retries = []
+        self._retry_sequence = count()  # tie-breaker: documents are not comparable
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._writer = threading.Thread(target=self._run_writer, name=f"mongodb-writer-{config.database}",
+                                        daemon=True)
+        self._writer.start()
+
+    def add_documents(self, collection_name: str, documents: list, max_retries: int = None, retry_delay: int = None,
+                      batch_size: int = None, write_concern: str = None):
+        """
+        Queue documents for insertion and return immediately.
+        Retries and write concern are the instance's: the per-call arguments are accepted for
+        compatibility with MongoDBDataAccess and ignored.
+        
+        Returns:
+            Future: resolves to the number of documents written once all of them are, or raises
+            RuntimeError if some could not be written after max_retries attempts
+        """
+        documents = list(documents)
+        pending_write = _PendingWrite(len(documents))
+        if not documents:
+            pending_write.future.set_result(0)
+            return pending_write.future
+        # Size estimated from one document, as cap_batch_size does
+        estimated_bytes = (json_size(documents[0], default=str) or 1) * len(documents)
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError(f"Buffered writer for {self.config.database} is stopped")
+            buffer = self._buffers.get(collection_name)
+            is_new = buffer is None
+            if is_new:
+                buffer = self._buffers[collection_name] = [[], [], 0, time.monotonic()]
+            buffer[0].extend(documents)
+            buffer[1].extend(repeat(pending_write, len(documents)))
+            buffer[2] += estimated_bytes
+            self._pending[collection_name] = self._pending.get(collection_name, 0) + len(documents)
+            # Wake the writer to write a full buffer, or to start timing a new one
+            if is_new or len(buffer[0]) >= self.max_docs or buffer[2] >= self.max_bytes:
+                self._condition.notify_all()
+        return pending_write.future
+
+    def flush(self, collection_names=None):
+        """
+        Write the buffered documents now and wait until they are written (or failed).
+        
+        Args:
+            collection_names: Collections to wait for (default: every collection). Other
+                              collections keep buffering, so unrelated writers are not waited on.
+        """
+        with self._condition:
+            names = list(self._pending) if collection_names is None else list(collection_names)
+            self._force.update(name for name in names if name in self._buffers)
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: not any(self._pending.get(name) for name in names))
+
+    def stop(self):
+        """
+        Write everything still buffered and stop the writer thread.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._writer.join()
+
+    def close(self):
+        """
+        Keep the client reference: the writer thread is still using it. stop() ends the writer
+        and shutdown() closes the shared client at exit.
+        """
+
+    def _take_ready(self):
+        """
+        Remove and return the (collection name, documents, owners, attempt) batches due for
+        writing, and the seconds until the next one is due (None if nothing is waiting).
+        Caller holds _condition.
+        """
+        now = time.monotonic()
+        ready = []
+        timeout = None
+        for name, (documents, owners, estimated_bytes, first_at) in list(self._buffers.items()):
+            due_in = first_at + self.flush_interval - now
+            if (self._stopping or name in self._force or due_in <= 0
+                    or len(documents) >= self.max_docs or estimated_bytes >= self.max_bytes):
+                del self._buffers[name]
+                self._force.discard(name)
+                ready.append((name, documents, owners, 0))
+            elif timeout is None or due_in < timeout:
+                timeout = due_in
+        while self._retries and self._retries[0][0] <= now:
+            _, _, name, documents, owners, attempt = heapq.heappop(self._retries)
+            ready.append((name, documents, owners, attempt))
+        if self._retries:
+            due_in = self._retries[0][0] - now
+            timeout = due_in if timeout is None else min(timeout, due_in)
+        return ready, timeout
+
+    def _run_writer(self):
+        while True:
+            with self._condition:
+                ready, timeout = self._take_ready()
+                while not ready:
+                    if self._stopping and not self._buffers and not self._retries:
+                        return
+                    self._condition.wait(timeout)
+                    ready, timeout = self._take_ready()
+            for collection_name, documents, owners, attempt in ready:
+                if attempt:
+                    self._write_batch(collection_name, documents, owners, attempt)
+                    continue
+                # Unordered bulk writes of up to max_docs documents, still capped under 16 MiB;
+                # each one is retried on its own so written batches are never sent twice
+                batch_size = cap_batch_size(documents[0], self.max_docs)
+                for start in range(0, len(documents), batch_size):
+                    self._write_batch(collection_name, documents[start:start + batch_size],
+                                      owners[start:start + batch_size], 0)
+
+    def _write_batch(self, collection_name: str, documents: list, owners: list, attempt: int):
+        """
+        Write one batch with a single attempt. On failure, schedule it again after
+        retry_delay * 2**attempt seconds (+/- 50% jitter) until max_retries attempts are used.
+        """
+        error = None
+        failed_indexes = []
+        try:
+            failed_indexes = self._insert_batch(collection_name, documents, 1, self.retry_delay,
+                                                self.write_concern, resent=attempt > 0)
+        except Exception as e:
+            if attempt + 1 < self.max_retries:
+                delay = self.retry_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning(f"Insert of {len(documents)} documents into {collection_name} failed "
+                               f"(attempt {attempt + 1}/{self.max_retries}), retrying in {delay:.1f}s: {e}")
+                with self._condition:
+                    heapq.heappush(self._retries, (time.monotonic() + delay, next(self._retry_sequence),
+                                                   collection_name, documents, owners, attempt + 1))
+                return
+            error = e
+            logger.error(f"Buffered insert of {len(documents)} documents into {collection_name} failed "
+                         f"after {self.max_retries} attempts: {e}")
+        self._complete(collection_name, owners, error, failed_indexes)
+
+    def _complete(self, collection_name: str, owners: list, error: Exception = None, failed_indexes: list = ()):
+        """
+        Account for a batch that is done, and resolve the futures of the add_documents calls that
+        have no document left to write. Either the whole batch was given up on (error), or only the
+        documents at failed_indexes could not be inserted (rejected even when re-inserted).
+        """
+        if error is not None:
+            failed = Counter(owners)
+        else:
+            failed = Counter(owners[i] for i in failed_indexes)
+            if failed:
+                error = "rejected by the server, see the FAILE_DOCUMENT_INSERT log lines"
+        finished = []
+        with self._condition:
+            for pending_write, done in Counter(owners).items():
+                pending_write.remaining -= done
+                if failed[pending_write]:
+                    pending_write.failed += failed[pending_write]
+                    pending_write.error = error
+                if not pending_write.remaining:
+                    finished.append(pending_write)
+            if failed:
+                self.failed_counts[collection_name] = (self.failed_counts.get(collection_name, 0)
+                                                       + sum(failed.values()))
+            self._pending[collection_name] -= len(owners)
+            if not self._pending[collection_name]:
+                # Nothing left to wait for: a later flush() must not force a new buffer
+                del self._pending[collection_name]
+                self._force.discard(collection_name)
+            self._condition.notify_all()
+        # Outside the lock: done callbacks run in this thread
+        for pending_write in finished:
+            if pending_write.failed:
+                pending_write.future.set_exception(RuntimeError(
+                    f"{pending_write.failed}/{pending_write.count} documents could not be inserted into "
+                    f"{collection_name}: {pending_write.error}"))
+            else:
+                pending_write.future.set_result(pending_write.count)
+
+atexit.register(MongoDBDataAccess.shutdown)
\ No newline at end of file
@@ -2,118 +2,238 @@
 Load Testing Module for Couchbase and MongoDB
 Tests concurrent user queries and generates performance metrics
 """
-import os
-import sys
 import time
-import json
-import statistics
+import random
+import asyncio
+import queue
+import logging
+import threading
+from collections import deque
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 from threading import Lock
-from typing import List, Dict, Tuple
+from typing import List, Dict
 import gc
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 
 from config import CouchbaseConfig, MongoDBConfig
 from dal.couchbase_dal import CouchbaseDataAccess
 from dal.mongodb_dal import MongoDBDataAccess
 from logger_config import get_logger
+from utils import json_dumps
+
+# Async drivers are only needed by run_concurrent_test_async
+try:
+    from acouchbase.cluster import Cluster as AsyncCluster
+    from couchbase.auth import PasswordAuthenticator
+    from couchbase.options import ClusterOptions, QueryOptions
+except ImportError:
+    AsyncCluster = None
+try:
+    from pymongo import AsyncMongoClient  # pymongo >= 4.10
+except ImportError:
+    AsyncMongoClient = None
 
 logger = get_logger(__name__)
 
-# Thread-safe lock for statistics
-stats_lock = Lock()
+# Number of query errors kept for the end-of-run log
+_MAX_LOGGED_ERRORS = 100
+
+# Default cap on the threads of run_concurrent_test (each user no longer gets a dedicated thread)
+_MAX_USER_THREADS = 256
+
+# Column codes for LoadTestResult.db_type in the statistics arrays
+_DB_TYPE_CODES = {'couchbase': 0, 'mongodb': 1}
+_RESULT_DTYPE = np.dtype([
+    ('db_type', np.uint8),
+    ('success', np.bool_),
+    ('response_time', np.float64),
+    ('records_returned', np.int64),
+    ('timestamp', np.float64),
+])
 
 
 class LoadTestResult:
     """Stores results from a single query execution"""
+    __slots__ = ('db_type', 'query_type', 'success', 'response_time', 'error', 'records_returned',
+                 'pool_wait_time', 'timestamp')
+    
     def __init__(self, db_type: str, query_type: str, success: bool, 
-                 response_time: float, error: str = None, records_returned: int = 0):
+                 response_time: float, error: str = None, records_returned: int = 0,
+                 pool_wait_time: float = 0.0):
         self.db_type = db_type  # 'couchbase' or 'mongodb'
         self.query_type = query_type  # 'select', 'count', etc.
         self.success = success
-        self.response_time = response_time  # in seconds
+        # in seconds, including the wait for a connection, as pymongo's pool checkout is for MongoDB
+        self.response_time = response_time
         self.error = error
         self.records_returned = records_returned
-        self.timestamp = datetime.now()
+        self.pool_wait_time = pool_wait_time  # part of response_time spent waiting for a pooled Couchbase connection
+        self.timestamp = time.time()  # POSIX seconds; converted to ISO format only in save_results
+
+
+class ConnectionPool:
+    """
+    Bounded pool of connected DAL instances shared by the load test threads.
+    DALs are created lazily, up to max_size; once all are in use, acquire() blocks.
+    """
+    def __init__(self, factory, max_size: int):
+        self._factory = factory
+        self._max_size = max_size
+        self._idle = queue.Queue()
+        self._created = []
+        self._reserved = 0  # DALs created or being created
+        self._lock = Lock()
+    
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._reserved < self._max_size
+            if create:
+                self._reserved += 1
+        if not create:
+            return self._idle.get()
+        # Connect outside the lock so several users can open their connections at once
+        try:
+            dal = self._factory()
+        except Exception:
+            with self._lock:
+                self._reserved -= 1
+            raise
+        with self._lock:
+            self._created.append(dal)
+        return dal
+    
+    def release(self, dal):
+        self._idle.put(dal)
+    
+    def close(self):
+        with self._lock:
+            for dal in self._created:
+                dal.close()
+            self._created.clear()
+            self._reserved = 0
+            self._idle = queue.Queue()
 
 
 class LoadTester:
     """Main class for load testing both databases"""
     
-    def __init__(self, bucket_name: str, collection_name: str, db_name: str = None):
+    def __init__(self, bucket_name: str, collection_name: str, db_name: str = None,
+                 max_pool_size: int = 32, decode: bool = True):
+        """
+        Args:
+            bucket_name: Name of Couchbase bucket
+            collection_name: Name of MongoDB collection
+            db_name: Name of MongoDB database
+            max_pool_size: Maximum number of Couchbase connections shared by the users (default: 32)
+            decode: If False, MongoDB documents are kept as raw BSON (RawBSONDocument), so the
+                    test measures the query and transfer without the client-side decode cost
+        """
         self.bucket_name = bucket_name
         self.collection_name = collection_name
         self.db_name = db_name
         self.cb_config = CouchbaseConfig()
         self.mongo_config = MongoDBConfig(db_name) if db_name else MongoDBConfig()
         self.results: List[LoadTestResult] = []
+        self.max_pool_size = max_pool_size
+        self._codec_options = None if decode else CodecOptions(document_class=RawBSONDocument)
+        # Couchbase clusters are thread-safe and expensive to open: users share a bounded pool.
+        # MongoDB DALs share one pooled MongoClient, so each thread just keeps its own DAL.
+        self._cb_pool = None
+        self._mongo_local = threading.local()
+        # Query errors are buffered during a run and logged once at the end (deque.append is thread-safe)
+        self._recent_errors = deque(maxlen=_MAX_LOGGED_ERRORS)
+        # Query type -> function returning the number of records; built once instead of if/elif per query
+        self._cb_select_all_query = f"SELECT meta().id, * FROM `{bucket_name}` LIMIT 100"
+        self._cb_handlers = {
+            "count": self._cb_count,
+            "select_all": self._cb_select_all,
+            "select_paginated": self._cb_select_paginated,
+            "custom": self._cb_custom,
+        }
+        self._mongo_handlers = {
+            "count": self._mongo_count,
+            "select_all": self._mongo_select_all,
+            "select_paginated": self._mongo_select_paginated,
+        }
+    
+    def _get_mongo_dal(self) -> MongoDBDataAccess:
+        mongo_dal = getattr(self._mongo_local, 'dal', None)
+        if mongo_dal is None:
+            mongo_dal = MongoDBDataAccess(self.mongo_config)
+            mongo_dal.connect()
+            self._mongo_local.dal = mongo_dal
+        return mongo_dal
+    
+    def _get_mongo_collection(self, database):
+        return database.get_collection(self.collection_name, codec_options=self._codec_options)
+    
+    def _create_cb_dal(self) -> CouchbaseDataAccess:
+        cb_dal = CouchbaseDataAccess(self.cb_config)
+        cb_dal.connect()
+        return cb_dal
+    
+    def close(self):
+        """Close the pooled Couchbase connections"""
+        if self._cb_pool is not None:
+            self._cb_pool.close()
+            self._cb_pool = None
         
+    def _cb_count(self, cb_dal: CouchbaseDataAccess, query: str = None) -> int:
+        # Count query, prepared once per connection and then only executed
+        return cb_dal.get_total_count(self.bucket_name, adhoc=False)
+    
+    def _cb_select_all(self, cb_dal: CouchbaseDataAccess, query: str = None) -> int:
+        # Select all with limit
+        data = cb_dal.get_data(self._cb_select_all_query)
+        return len(data) if data else 0
+    
+    def _cb_select_paginated(self, cb_dal: CouchbaseDataAccess, query: str = None) -> int:
+        data = cb_dal.get_data_paginated(bucket_name=self.bucket_name, page_size=100, offset=0)
+        return len(data) if data else 0
+    
+    def _cb_custom(self, cb_dal: CouchbaseDataAccess, query: str = None) -> int:
+        if not query:
+            raise ValueError("query_type 'custom' requires a query")
+        data = cb_dal.get_data(query)
+        return len(data) if data else 0
+    
     def _execute_couchbase_query(self, query_type: str, query: str = None) -> LoadTestResult:
         """Execute a single query against Couchbase"""
         cb_dal = None
-        start_time = time.time()
+        pool_wait_time = 0.0
+        start_time = time.perf_counter()
         try:
-            cb_dal = CouchbaseDataAccess(self.cb_config)
-            
-            if query_type == "count":
-                # Count query
-                count = cb_dal.get_total_count(self.bucket_name)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="couchbase",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=count
-                )
-            elif query_type == "select_all":
-                # Select all with limit
-                query = f"SELECT meta().id, * FROM `{self.bucket_name}` LIMIT 100"
-                data = cb_dal.get_data(query)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="couchbase",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=len(data) if data else 0
-                )
-            elif query_type == "select_paginated":
-                # Paginated query
-                data = cb_dal.get_data_paginated(
-                    bucket_name=self.bucket_name,
-                    page_size=100,
-                    offset=0
-                )
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="couchbase",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=len(data) if data else 0
-                )
-            elif query and query_type == "custom":
-                # Custom query
-                data = cb_dal.get_data(query)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="couchbase",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=len(data) if data else 0
-                )
-            else:
+            handler = self._cb_handlers.get(query_type)
+            if handler is None:
                 raise ValueError(f"Unknown query type: {query_type}")
-                
+            cb_dal = self._cb_pool.acquire()
+            # Kept in response_time: MongoDB timings include pymongo's own pool checkout too
+            pool_wait_time = time.perf_counter() - start_time
+            
+            records_returned = handler(cb_dal, query)
+            response_time = time.perf_counter() - start_time
+            return LoadTestResult(
+                db_type="couchbase",
+                pool_wait_time=pool_wait_time,
+                query_type=query_type,
+                success=True,
+                response_time=response_time,
+                records_returned=records_returned
+            )
         except Exception as e:
-            response_time = time.time() - start_time
-            logger.error(f"Couchbase query error: {e}", exc_info=True)
+            response_time = time.perf_counter() - start_time
+            self._recent_errors.append(f"Couchbase {query_type} query error: {e!r}")
             return LoadTestResult(
                 db_type="couchbase",
+                pool_wait_time=pool_wait_time,
                 query_type=query_type,
                 success=False,
                 response_time=response_time,
@@ -121,59 +241,42 @@ class LoadTester:
             )
         finally:
             if cb_dal:
-                cb_dal.close()
-            gc.collect()
+                self._cb_pool.release(cb_dal)
+    
+    @staticmethod
+    def _mongo_count(collection, filter_doc: dict) -> int:
+        return collection.count_documents(filter_doc)
+    
+    @staticmethod
+    def _mongo_select_all(collection, filter_doc: dict) -> int:
+        # Count while iterating: only the length is needed, not a list of documents
+        return sum(1 for _ in collection.find(filter_doc).limit(100))
+    
+    @staticmethod
+    def _mongo_select_paginated(collection, filter_doc: dict) -> int:
+        return sum(1 for _ in collection.find(filter_doc).skip(0).limit(100))
     
     def _execute_mongodb_query(self, query_type: str, filter_query: dict = None) -> LoadTestResult:
         """Execute a single query against MongoDB"""
-        mongo_dal = None
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
-            mongo_dal = MongoDBDataAccess(self.mongo_config)
-            mongo_dal.connect()
-            collection = mongo_dal.database[self.collection_name]
-            
-            if query_type == "count":
-                # Count query
-                count = collection.count_documents({} if filter_query is None else filter_query)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="mongodb",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=count
-                )
-            elif query_type == "select_all":
-                # Find all with limit
-                cursor = collection.find({} if filter_query is None else filter_query).limit(100)
-                data = list(cursor)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="mongodb",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=len(data)
-                )
-            elif query_type == "select_paginated":
-                # Paginated query
-                cursor = collection.find({} if filter_query is None else filter_query).skip(0).limit(100)
-                data = list(cursor)
-                response_time = time.time() - start_time
-                return LoadTestResult(
-                    db_type="mongodb",
-                    query_type=query_type,
-                    success=True,
-                    response_time=response_time,
-                    records_returned=len(data)
-                )
-            else:
+            handler = self._mongo_handlers.get(query_type)
+            if handler is None:
                 raise ValueError(f"Unknown query type: {query_type}")
-                
+            collection = self._get_mongo_collection(self._get_mongo_dal().database)
+            
+            records_returned = handler(collection, {} if filter_query is None else filter_query)
+            response_time = time.perf_counter() - start_time
+            return LoadTestResult(
+                db_type="mongodb",
+                query_type=query_type,
+                success=True,
+                response_time=response_time,
+                records_returned=records_returned
+            )
         except Exception as e:
-            response_time = time.time() - start_time
-            logger.error(f"MongoDB query error: {e}", exc_info=True)
+            response_time = time.perf_counter() - start_time
+            self._recent_errors.append(f"MongoDB {query_type} query error: {e!r}")
             return LoadTestResult(
                 db_type="mongodb",
                 query_type=query_type,
@@ -181,10 +284,6 @@ class LoadTester:
                 response_time=response_time,
                 error=str(e)
             )
-        finally:
-            if mongo_dal:
-                mongo_dal.close()
-            gc.collect()
     
     def _run_single_user_test(self, db_type: str, query_type: str, 
                               query: str = None, filter_query: dict = None) -> LoadTestResult:
@@ -198,7 +297,9 @@ class LoadTester:
     
     def run_concurrent_test(self, num_users: int, query_type: str = "select_all",
                            db_types: List[str] = None, duration_seconds: int = None,
-                           query: str = None, filter_query: dict = None) -> Dict:
+                           query: str = None, filter_query: dict = None,
+                           think_time_s: float = 0.1, target_qps_per_user: float = None,
+                           max_workers: int = None) -> Dict:
         """
         Run concurrent load test
         
@@ -209,27 +310,46 @@ class LoadTester:
             duration_seconds: Duration to run test in seconds (None = run once per user)
             query: Custom query string for Couchbase (if query_type='custom')
             filter_query: Custom filter dict for MongoDB (if query_type='custom')
+            think_time_s: Pause between two queries of the same user, 0 = closed loop without pause (default: 0.1)
+            target_qps_per_user: If set, open loop: each user sends queries with Poisson arrivals at this
+                rate, regardless of response times (think_time_s is then ignored)
+            max_workers: Number of threads running the users (default: one per user and database, at most
+                _MAX_USER_THREADS). Extra users wait for a free thread; use run_concurrent_test_async to
+                keep more users concurrent
         
         Returns:
             Dictionary with test results and statistics
         """
         if db_types is None:
             db_types = ["couchbase", "mongodb"]
+        num_tasks = num_users * len(db_types)
+        if max_workers is None:
+            max_workers = min(num_tasks, _MAX_USER_THREADS)
         
         logger.info(f"Starting load test: {num_users} concurrent users, query_type={query_type}")
         logger.info(f"Testing databases: {db_types}")
         if duration_seconds:
             logger.info(f"Test duration: {duration_seconds} seconds")
+        if num_tasks > max_workers:
+            logger.warning(f"{num_tasks} user tasks share {max_workers} threads: "
+                           f"at most {max_workers} run at the same time")
         
         self.results = []
-        start_time = time.time()
+        self._recent_errors.clear()
+        # Collect garbage left by the previous run once, outside the measured window
+        gc.collect()
+        if self._cb_pool is None and "couchbase" in db_types:
+            self._cb_pool = ConnectionPool(self._create_cb_dal, self.max_pool_size)
+        start_time = time.perf_counter()
+        # Monotonic deadline: not affected by wall-clock (NTP) adjustments during the test
+        deadline = time.monotonic() + duration_seconds if duration_seconds else None
         
         def run_user_queries(db_type: str, user_id: int):
             """Run queries for a single user"""
             user_results = []
-            end_time = start_time + duration_seconds if duration_seconds else start_time + 1
+            next_send = time.monotonic()
             
-            while time.time() < end_time or not duration_seconds:
+            while True:
                 result = self._run_single_user_test(
                     db_type=db_type,
                     query_type=query_type,
@@ -238,35 +358,242 @@ class LoadTester:
                 )
                 user_results.append(result)
                 
-                if not duration_seconds:
-                    # Run once if no duration specified
+                # Run once if no duration specified
+                if deadline is None or time.monotonic() >= deadline:
                     break
-                    
-                # Small delay between queries for same user
-                time.sleep(0.1)
+                
+                if target_qps_per_user:
+                    # Open loop: schedule from the previous send time, not from when the query finished
+                    next_send += random.expovariate(target_qps_per_user)
+                    if next_send >= deadline:
+                        break
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                elif think_time_s:
+                    # Delay between queries for same user
+                    time.sleep(think_time_s)
             
             return user_results
         
-        # Run tests concurrently
-        with ThreadPoolExecutor(max_workers=num_users * len(db_types)) as executor:
-            futures = []
+        # Run tests concurrently; INFO logs are muted for the measurement window, errors still go through
+        logging.disable(logging.INFO)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Submit tasks for each user and database
+                future_to_user = {
+                    executor.submit(run_user_queries, db_type, user_id): (db_type, user_id)
+                    for user_id in range(num_users)
+                    for db_type in db_types
+                }
+                
+                # Collect each user's result list in completion order, then flatten once
+                all_user_results = []
+                for future in as_completed(future_to_user):
+                    db_type, user_id = future_to_user[future]
+                    try:
+                        all_user_results.append(future.result())
+                    except Exception as e:
+                        logger.error(f"Error in user {user_id} for {db_type}: {e}", exc_info=True)
+                self.results = list(chain.from_iterable(all_user_results))
+        finally:
+            logging.disable(logging.NOTSET)
+        
+        total_time = time.perf_counter() - start_time
+        self._log_recent_errors()
+        
+        # Calculate statistics
+        stats = self._calculate_statistics()
+        stats['total_test_time'] = total_time
+        stats['num_users'] = num_users
+        stats['query_type'] = query_type
+        
+        logger.info(f"Load test completed in {total_time:.2f} seconds")
+        logger.info(f"Total queries executed: {stats['total_queries']}")
+        
+        return stats
+    
+    async def _execute_couchbase_query_async(self, cluster, query_type: str, query: str = None) -> LoadTestResult:
+        """Execute a single query against Couchbase on the event loop"""
+        start_time = time.perf_counter()
+        try:
+            named_parameters = None
+            adhoc = True
+            if query_type == "count":
+                statement = f"SELECT RAW COUNT(*) FROM `{self.bucket_name}`"
+                adhoc = False
+            elif query_type == "select_all":
+                statement = self._cb_select_all_query
+            elif query_type == "select_paginated":
+                statement = CouchbaseDataAccess._build_page_query(self.bucket_name, "meta().id, *")
+                named_parameters = {'limit': 100, 'offset': 0}
+            elif query and query_type == "custom":
+                statement = query
+            else:
+                raise ValueError(f"Unknown query type: {query_type}")
             
-            # Submit tasks for each user and database
-            for user_id in range(num_users):
-                for db_type in db_types:
-                    future = executor.submit(run_user_queries, db_type, user_id)
-                    futures.append((future, db_type, user_id))
+            if named_parameters:
+                options = QueryOptions(named_parameters=named_parameters, adhoc=False)
+            else:
+                options = QueryOptions(adhoc=adhoc)
+            rows = [row async for row in cluster.query(statement, options).rows()]
+            response_time = time.perf_counter() - start_time
+            return LoadTestResult(
+                db_type="couchbase",
+                query_type=query_type,
+                success=True,
+                response_time=response_time,
+                records_returned=(rows[0] if rows else 0) if query_type == "count" else len(rows)
+            )
+        except Exception as e:
+            response_time = time.perf_counter() - start_time
+            self._recent_errors.append(f"Couchbase {query_type} query error: {e!r}")
+            return LoadTestResult(
+                db_type="couchbase",
+                query_type=query_type,
+                success=False,
+                response_time=response_time,
+                error=str(e)
+            )
+    
+    async def _execute_mongodb_query_async(self, collection, query_type: str, filter_query: dict = None) -> LoadTestResult:
+        """Execute a single query against MongoDB on the event loop"""
+        start_time = time.perf_counter()
+        try:
+            filter_doc = {} if filter_query is None else filter_query
+            if query_type == "count":
+                records_returned = await collection.count_documents(filter_doc)
+            elif query_type == "select_all":
+                records_returned = 0
+                async for _ in collection.find(filter_doc).limit(100):
+                    records_returned += 1
+            elif query_type == "select_paginated":
+                records_returned = 0
+                async for _ in collection.find(filter_doc).skip(0).limit(100):
+                    records_returned += 1
+            else:
+                raise ValueError(f"Unknown query type: {query_type}")
             
-            # Collect results
-            for future, db_type, user_id in futures:
-                try:
-                    user_results = future.result()
-                    with stats_lock:
-                        self.results.extend(user_results)
-                except Exception as e:
-                    logger.error(f"Error in user {user_id} for {db_type}: {e}", exc_info=True)
+            response_time = time.perf_counter() - start_time
+            return LoadTestResult(
+                db_type="mongodb",
+                query_type=query_type,
+                success=True,
+                response_time=response_time,
+                records_returned=records_returned
+            )
+        except Exception as e:
+            response_time = time.perf_counter() - start_time
+            self._recent_errors.append(f"MongoDB {query_type} query error: {e!r}")
+            return LoadTestResult(
+                db_type="mongodb",
+                query_type=query_type,
+                success=False,
+                response_time=response_time,
+                error=str(e)
+            )
+    
+    async def _run_users_async(self, num_users: int, query_type: str, db_types: List[str],
+                               duration_seconds: int = None, query: str = None, filter_query: dict = None,
+                               think_time_s: float = 0.1, target_qps_per_user: float = None):
+        """Run every user as a coroutine; all users share one Couchbase cluster and one MongoDB client"""
+        cluster = None
+        mongo_client = None
+        executors = {}
+        try:
+            if "couchbase" in db_types:
+                cluster_options = ClusterOptions(PasswordAuthenticator(self.cb_config.user, self.cb_config.password))
+                cluster = await AsyncCluster.connect(f"couchbase://{self.cb_config.host}", cluster_options)
+                executors["couchbase"] = lambda: self._execute_couchbase_query_async(cluster, query_type, query)
+            if "mongodb" in db_types:
+                mongo_client = AsyncMongoClient(self.mongo_config.connection_string,
+                                                **MongoDBDataAccess(self.mongo_config).client_options())
+                collection = self._get_mongo_collection(mongo_client[self.mongo_config.database])
+                executors["mongodb"] = lambda: self._execute_mongodb_query_async(collection, query_type, filter_query)
+            
+            deadline = time.monotonic() + duration_seconds if duration_seconds else None
+            
+            async def run_user_queries(db_type: str):
+                """Run queries for a single user"""
+                next_send = time.monotonic()
+                while True:
+                    # Results are only appended on the loop thread, no lock needed
+                    self.results.append(await executors[db_type]())
+                    if deadline is None or time.monotonic() >= deadline:
+                        break
+                    if target_qps_per_user:
+                        next_send += random.expovariate(target_qps_per_user)
+                        if next_send >= deadline:
+                            break
+                        await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+                    elif think_time_s:
+                        # Delay between queries for same user
+                        await asyncio.sleep(think_time_s)
+            
+            await asyncio.gather(*(run_user_queries(db_type)
+                                   for _ in range(num_users) for db_type in db_types))
+        finally:
+            if cluster is not None:
+                await cluster.close()
+            if mongo_client is not None:
+                await mongo_client.close()
+    
+    def run_concurrent_test_async(self, num_users: int, query_type: str = "select_all",
+                                  db_types: List[str] = None, duration_seconds: int = None,
+                                  query: str = None, filter_query: dict = None,
+                                  think_time_s: float = 0.1, target_qps_per_user: float = None) -> Dict:
+        """
+        Same test as run_concurrent_test, but each user is a coroutine on a single event loop
+        instead of a thread, so thousands of users do not need thousands of threads.
+        Needs the async drivers: acouchbase (couchbase SDK 4.x) and pymongo >= 4.10.
+        Uses uvloop when it is installed.
+        
+        Args:
+            num_users: Number of concurrent users
+            query_type: Type of query to run ('count', 'select_all', 'select_paginated', 'custom')
+            db_types: List of database types to test ['couchbase', 'mongodb'] or None for both
+            duration_seconds: Duration to run test in seconds (None = run once per user)
+            query: Custom query string for Couchbase (if query_type='custom')
+            filter_query: Custom filter dict for MongoDB (if query_type='custom')
+            think_time_s: Pause between two queries of the same user, 0 = no pause (default: 0.1)
+            target_qps_per_user: If set, open loop with Poisson arrivals at this rate per user
         
-        total_time = time.time() - start_time
+        Returns:
+            Dictionary with test results and statistics
+        """
+        if db_types is None:
+            db_types = ["couchbase", "mongodb"]
+        if "couchbase" in db_types and AsyncCluster is None:
+            raise ImportError("acouchbase is required for async Couchbase load tests")
+        if "mongodb" in db_types and AsyncMongoClient is None:
+            raise ImportError("pymongo >= 4.10 is required for async MongoDB load tests")
+        
+        logger.info(f"Starting async load test: {num_users} concurrent users, query_type={query_type}")
+        logger.info(f"Testing databases: {db_types}")
+        if duration_seconds:
+            logger.info(f"Test duration: {duration_seconds} seconds")
+        
+        self.results = []
+        self._recent_errors.clear()
+        gc.collect()
+        start_time = time.perf_counter()
+        
+        coroutine = self._run_users_async(num_users, query_type, db_types, duration_seconds, query, filter_query,
+                                          think_time_s, target_qps_per_user)
+        logging.disable(logging.INFO)
+        try:
+            try:
+                import uvloop
+            except ImportError:
+                asyncio.run(coroutine)
+            else:
+                with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                    runner.run(coroutine)
+        finally:
+            logging.disable(logging.NOTSET)
+        
+        total_time = time.perf_counter() - start_time
+        self._log_recent_errors()
         
         # Calculate statistics
         stats = self._calculate_statistics()
@@ -279,18 +606,40 @@ class LoadTester:
         
         return stats
     
-    def _calculate_throughput(self, db_results: List[LoadTestResult], successful: List[LoadTestResult]) -> float:
+    def _log_recent_errors(self):
+        """Log the query errors buffered during the run"""
+        if not self._recent_errors:
+            return
+        failed = sum(1 for r in self.results if not r.success)
+        logger.error(f"{failed} queries failed, last {len(self._recent_errors)} errors:")
+        for error in self._recent_errors:
+            logger.error(f"  {error}")
+    
+    def _calculate_throughput(self, timestamps: np.ndarray, successful_count: int) -> float:
         """Calculate throughput in queries per second"""
-        if len(db_results) < 2 or len(successful) == 0:
+        if len(timestamps) < 2 or successful_count == 0:
             return 0.0
         
-        timestamps = [r.timestamp.timestamp() for r in db_results]
-        time_span = max(timestamps) - min(timestamps)
+        time_span = timestamps.max() - timestamps.min()
         
         if time_span <= 0:
-            return float(len(successful))
+            return float(successful_count)
         
-        return len(successful) / time_span
+        return successful_count / float(time_span)
+    
+    def _result_columns(self) -> np.ndarray:
+        """
+        Struct-of-arrays view of self.results, filled in a single pass over the result objects.
+        Each field (db_type, success, response_time, records_returned, timestamp) is a NumPy column.
+        """
+        results = self.results
+        codes = _DB_TYPE_CODES
+        return np.fromiter(
+            ((codes[r.db_type], r.success, r.response_time, r.records_returned or 0, r.timestamp)
+             for r in results),
+            _RESULT_DTYPE,
+            count=len(results)
+        )
     
     def _calculate_statistics(self) -> Dict:
         """Calculate statistics from test results"""
@@ -299,11 +648,13 @@ class LoadTester:
             'mongodb': {},
             'total_queries': len(self.results)
         }
+        columns = self._result_columns()
         
-        for db_type in ['couchbase', 'mongodb']:
-            db_results = [r for r in self.results if r.db_type == db_type]
+        for db_type, code in _DB_TYPE_CODES.items():
+            db_mask = columns['db_type'] == code
+            total = int(db_mask.sum())
             
-            if not db_results:
+            if not total:
                 stats[db_type] = {
                     'total_queries': 0,
                     'successful_queries': 0,
@@ -320,35 +671,43 @@ class LoadTester:
                 }
                 continue
             
-            successful = [r for r in db_results if r.success]
-            failed = [r for r in db_results if not r.success]
+            success_mask = db_mask & columns['success']
+            successful = int(success_mask.sum())
+            failed = total - successful
+            # Errors are rare: only the first 10 failed rows are looked up
+            errors = [self.results[i].error for i in np.flatnonzero(db_mask & ~columns['success'])[:10]]
             
-            response_times = [r.response_time for r in successful]
-            
-            if response_times:
-                response_times_sorted = sorted(response_times)
-                n = len(response_times_sorted)
+            if successful:
+                response_times = columns['response_time'][success_mask]
+                # One partial sort places every rank needed (no full sort). Same definitions as
+                # the reports before NumPy: p95/p99 are sorted[int(n * q)] and the median averages
+                # the two middle values when n is even
+                n = successful
+                lower_mid, upper_mid, i95, i99 = (n - 1) // 2, n // 2, int(n * 0.95), int(n * 0.99)
+                ranked = np.partition(response_times, [lower_mid, upper_mid, i95, i99])
+                median = (ranked[lower_mid] + ranked[upper_mid]) / 2
+                p95, p99 = ranked[i95], ranked[i99]
                 
                 stats[db_type] = {
-                    'total_queries': len(db_results),
-                    'successful_queries': len(successful),
-                    'failed_queries': len(failed),
-                    'success_rate': len(successful) / len(db_results) * 100 if db_results else 0.0,
-                    'avg_response_time': statistics.mean(response_times),
-                    'min_response_time': min(response_times),
-                    'max_response_time': max(response_times),
-                    'median_response_time': statistics.median(response_times),
-                    'p95_response_time': response_times_sorted[int(n * 0.95)] if n > 0 else 0.0,
-                    'p99_response_time': response_times_sorted[int(n * 0.99)] if n > 0 else 0.0,
-                    'throughput_qps': self._calculate_throughput(db_results, successful),
-                    'total_records_returned': sum(r.records_returned for r in successful),
-                    'errors': [r.error for r in failed[:10]]  # First 10 errors
+                    'total_queries': total,
+                    'successful_queries': successful,
+                    'failed_queries': failed,
+                    'success_rate': successful / total * 100,
+                    'avg_response_time': float(response_times.mean()),
+                    'min_response_time': float(response_times.min()),
+                    'max_response_time': float(response_times.max()),
+                    'median_response_time': float(median),
+                    'p95_response_time': float(p95),
+                    'p99_response_time': float(p99),
+                    'throughput_qps': self._calculate_throughput(columns['timestamp'][db_mask], successful),
+                    'total_records_returned': int(columns['records_returned'][success_mask].sum()),
+                    'errors': errors  # First 10 errors
                 }
             else:
                 stats[db_type] = {
-                    'total_queries': len(db_results),
+                    'total_queries': total,
                     'successful_queries': 0,
-                    'failed_queries': len(failed),
+                    'failed_queries': failed,
                     'success_rate': 0.0,
                     'avg_response_time': 0.0,
                     'min_response_time': 0.0,
@@ -358,7 +717,7 @@ class LoadTester:
                     'p99_response_time': 0.0,
                     'throughput_qps': 0.0,
                     'total_records_returned': 0,
-                    'errors': [r.error for r in failed[:10]]
+                    'errors': errors
                 }
         
         return stats
@@ -367,30 +726,40 @@ class LoadTester:
         """Get all test results"""
         return self.results
     
-    def save_results(self, filename: str):
-        """Save results to JSON file"""
-        results_data = {
-            'test_info': {
-                'bucket_name': self.bucket_name,
-                'collection_name': self.collection_name,
-                'timestamp': datetime.now().isoformat()
-            },
-            'results': [
-                {
-                    'db_type': r.db_type,
-                    'query_type': r.query_type,
-                    'success': r.success,
-                    'response_time': r.response_time,
-                    'error': r.error,
-                    'records_returned': r.records_returned,
-                    'timestamp': r.timestamp.isoformat()
-                }
-                for r in self.results
-            ]
+    def save_results(self, filename: str, ndjson: bool = False):
+        """
+        Save results to a JSON file
+        
+        Args:
+            filename: Output file path
+            ndjson: If True, stream newline-delimited JSON (test_info line, then one line per result)
+                instead of building a single document in memory
+        """
+        test_info = {
+            'bucket_name': self.bucket_name,
+            'collection_name': self.collection_name,
+            'timestamp': datetime.now().isoformat()
         }
+        rows = (
+            {
+                'db_type': r.db_type,
+                'query_type': r.query_type,
+                'success': r.success,
+                'response_time': r.response_time,
+                'error': r.error,
+                'records_returned': r.records_returned,
+                'pool_wait_time': r.pool_wait_time,
+                'timestamp': datetime.fromtimestamp(r.timestamp).isoformat()
+            }
+            for r in self.results
+        )
         
-        with open(filename, 'w') as f:
-            json.dump(results_data, f, indent=2)
+        with open(filename, 'w', encoding='utf-8') as f:
+            if ndjson:
+                f.write(json_dumps({'test_info': test_info}) + '\n')
+                f.writelines(json_dumps(row) + '\n' for row in rows)
+            else:
+                f.write(json_dumps({'test_info': test_info, 'results': list(rows)}))
         
         logger.info(f"Results saved to {filename}")
 
@@ -1,8 +1,28 @@
+import atexit
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from datetime import datetime
 
+# Background thread writing queued records to the file and console handlers (see setup_logging)
+_listener = None
+# setup_logging configures the root logger once; later calls are no-ops unless force=True
+_configured = False
+_setup_lock = threading.Lock()
+
+
+def _stop_listener():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
 class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
     """
     Custom handler that rotates based on both time (daily) and size (10MB)
@@ -14,16 +34,43 @@ class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
             os.makedirs(log_dir, exist_ok=True)
         
         # Add date to filename
-        base_name = os.path.splitext(filename)[0]
-        ext = os.path.splitext(filename)[1] or '.log'
+        base_name, ext = os.path.splitext(filename)
+        ext = ext or '.log'
         date_str = datetime.now().strftime('%Y-%m-%d')
         dated_filename = f"{base_name}_{date_str}{ext}"
         
+        # Bytes in the current file, tracked in emit() instead of seeking to the end on every record
+        self._bytes_written = 0
+        # Last formatted record: shouldRollover and emit format the same record back to back
+        self._formatted_record = None
+        self._formatted_msg = None
         super().__init__(dated_filename, when=when, interval=interval, backupCount=backupCount, encoding=encoding, delay=delay, utc=utc, atTime=atTime)
         self.max_bytes = max_bytes
         self.base_filename = base_name
         self.ext = ext
     
+    def _open(self):
+        stream = super()._open()
+        self._bytes_written = os.path.getsize(self.baseFilename)
+        return stream
+    
+    def format(self, record):
+        if record is self._formatted_record:
+            return self._formatted_msg
+        msg = super().format(record)
+        self._formatted_record = record
+        self._formatted_msg = msg
+        return msg
+    
+    def _record_size(self, record):
+        """Size in bytes of the line written for record"""
+        return len(self.format(record).encode(self.encoding or 'utf-8', 'replace')) + len(self.terminator)
+    
+    def emit(self, record):
+        super().emit(record)
+        if self.max_bytes > 0:
+            self._bytes_written += self._record_size(record)
+    
     def shouldRollover(self, record):
         """
         Determine if rollover should occur based on both time and size
@@ -32,14 +79,9 @@ class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
         if super().shouldRollover(record):
             return True
         
-        # Check size-based rollover
-        if self.stream is None:
-            self.stream = self._open()
-        
+        # Check size-based rollover against the running byte count (no seek/tell per record)
         if self.max_bytes > 0:
-            msg = "%s\n" % self.format(record)
-            self.stream.seek(0, 2)  # Seek to end of file
-            if self.stream.tell() + len(msg) >= self.max_bytes:
+            if self._bytes_written + self._record_size(record) >= self.max_bytes:
                 return True
         
         return False
@@ -99,17 +141,35 @@ class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
                 except OSError:
                     pass
 
-def setup_logging(log_dir='logs', log_level=logging.INFO):
+def setup_logging(log_dir='logs', log_level=logging.INFO, force=False):
     """
-    Setup logging configuration with all levels, daily rotation, and 10MB size limit
+    Setup logging configuration with all levels, daily rotation, and 10MB size limit.
+    Only the first call configures logging, so modules can call it at import time.
     
     Args:
         log_dir: Directory to store log files
         log_level: Minimum logging level (default: DEBUG to capture all levels)
+        force: If True, replace the existing configuration
     
     Returns:
         logger: Configured logger instance
     """
+    global _configured
+    with _setup_lock:
+        if _configured and not force:
+            return logging.getLogger()
+        logger = _configure_logging(log_dir, log_level)
+        _configured = True
+        return logger
+
+
+def _configure_logging(log_dir, log_level):
+    # The formatter does not use thread/process fields: skip collecting them for every record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+    
     # Create logs directory if it doesn't exist
     if not os.path.exists(log_dir):
         os.makedirs(log_dir, exist_ok=True)
@@ -139,13 +199,19 @@ def setup_logging(log_dir='logs', log_level=logging.INFO):
     )
     file_handler.setLevel(log_level)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
     
     # Console handler (optional - for development)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    
+    # Callers only put records on a queue; formatting and I/O happen on the listener thread
+    global _listener
+    _stop_listener()
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
     
     return logger
 
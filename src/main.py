@@ -1,16 +1,16 @@
 
+import atexit
 import logging
-import json
-# import pandas as pd
-import gc
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
 from multiprocessing import process
 from threading import Lock
 import time
+from functools import partial
 
-from config import CouchbaseConfig, MongoDBConfig
+from config import CouchbaseConfig, MongoDBConfig, get_db_setting, get_max_workers
 from dal.couchbase_dal import CouchbaseDataAccess
-from dal.mongodb_dal import MongoDBDataAccess
+from dal.mongodb_dal import BufferedMongoDBDataAccess, MongoDBDataAccess
 from logger_config import setup_logging, get_logger
 
 from services.couchbase_service import CouchbaseService
@@ -20,78 +20,137 @@ from services.mongodb_service import MongoDBService
 setup_logging(log_dir='logs', log_level=logging.INFO)
 logger = get_logger(__name__)
 
-# Thread-safe lock for logging
-fetch_lock = Lock()
-
 # RMS_BUCKET_LIST = ["rms_events","rms_journal","rms_rating_model","rms_read_model","rms_view","rms_write_model"]
 
-DB_SETTING = json.load(open('./src/dbsetting.json', 'r'))
+DB_SETTING = get_db_setting()
+
+# Each worker thread keeps one Couchbase connection and one MongoDB service per database
+# for all the pages it processes, instead of connecting again for every page
+_thread_services = threading.local()
+_cb_services = {}  # thread -> Couchbase service handed out to it, closed by _close_cb_services()
+_cb_services_lock = Lock()
+# Database name -> buffered DAL shared by every worker: inserts from many pages are merged
+# into larger unordered bulk writes by its writer thread
+_mongo_dals = {}
+_mongo_dals_lock = Lock()
+
+
+def _get_cb_service() -> CouchbaseService:
+    cb_service = getattr(_thread_services, 'cb', None)
+    if cb_service is None:
+        cb_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
+        _thread_services.cb = cb_service
+        with _cb_services_lock:
+            _cb_services[threading.current_thread()] = cb_service
+    return cb_service
+
+
+def _get_mongo_service(db_name: str) -> MongoDBService:
+    mongo_services = getattr(_thread_services, 'mongo', None)
+    if mongo_services is None:
+        mongo_services = _thread_services.mongo = {}
+    mongo_service = mongo_services.get(db_name)
+    if mongo_service is None:
+        mongo_service = MongoDBService(_get_mongo_dal(db_name), mapping_id=True)
+        mongo_services[db_name] = mongo_service
+    return mongo_service
 
-def process_page(db_name: str, bucket_name: str, migrate_keep_structure: bool, page: int, page_size: int, max_retries: int = 3, retry_delay: int = 2):
+
+def _get_mongo_dal(db_name: str) -> BufferedMongoDBDataAccess:
+    with _mongo_dals_lock:
+        mongo_dal = _mongo_dals.get(db_name)
+        if mongo_dal is None:
+            mongo_dal = _mongo_dals[db_name] = BufferedMongoDBDataAccess(MongoDBConfig(db_name))
+    return mongo_dal
+
+
+def _stop_mongo_dals():
     """
-    Fetch a page from Couchbase and insert into MongoDB.
+    Write the documents still buffered and stop the writer threads.
+    Registered with atexit, so it runs before MongoDBDataAccess.shutdown() closes the clients.
+    """
+    with _mongo_dals_lock:
+        mongo_dals = list(_mongo_dals.values())
+        _mongo_dals.clear()
+    for mongo_dal in mongo_dals:
+        mongo_dal.stop()
+
+
+def _close_cb_services(finished_threads_only: bool = False):
+    """
+    Close the Couchbase connections handed out to threads.
+    A service used again afterwards reconnects on its next query.
+    MongoDB clients are shared and closed at exit by MongoDBDataAccess.shutdown().
+    
+    Args:
+        finished_threads_only: If True, only close the connections of threads that have exited
+            (e.g. the workers of a finished executor), leaving buckets still migrating untouched
+    """
+    with _cb_services_lock:
+        threads = [t for t in _cb_services if not (finished_threads_only and t.is_alive())]
+        cb_services = [_cb_services.pop(t) for t in threads]
+    for cb_service in cb_services:
+        cb_service.cb_dal.close()
+
+
+atexit.register(_close_cb_services)
+atexit.register(_stop_mongo_dals)
+
+def store_page(db_name: str, bucket_name: str, migrate_keep_structure: bool, page: int, page_data: list,
+               collections: set = None):
+    """
+    Insert a page already fetched from Couchbase into MongoDB and wait until it is written
+    (the buffered writer may merge it with other pages).
     
     Args:
         db_name: MongoDB database name
         bucket_name: Couchbase bucket name (also the MongoDB collection name)
         migrate_keep_structure: True if migrate data with original structure, False if migrate data with RMS structure
         page: Page number (starts from 0)
-        page_size: Number of records per page (default: 1000)
-        max_retries: Maximum number of retries (default: 3)
-        retry_delay: Delay between retries (default: 2)
+        page_data: Documents of the page
+        collections: Optional set that receives the names of the MongoDB collections written to
         
     Returns:
-        tuple: (page, success_count) or (page, 0) if failed (NO_DATA_FOUND)
+        tuple: (page, success_count) or (page, 0) if failed
     """
-    cb_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
-    mongo_service = MongoDBService(MongoDBDataAccess(MongoDBConfig(db_name)), mapping_id=True)
+    mongo_service = _get_mongo_service(db_name)
     try:
-        # Fetch data from Couchbase
-        page_data = cb_service.get_data_paginated(
-            bucket_name=bucket_name,
-            page=page,
-            page_size=page_size,
-            max_retries=max_retries,
-            retry_delay=retry_delay
-        )
-        if page_data is None:
-            return (page, 0)
-        # Insert into MongoDB
         if migrate_keep_structure:
+            written = [bucket_name]
             mongo_service.add_documents(bucket_name, page_data)
         else:
-            mongo_service.process_rms_data(bucket_name, page, page_data)
+            written = mongo_service.process_rms_data(bucket_name, page, page_data)
+        if collections is not None:
+            collections.update(written)
         
-        with fetch_lock:
-            logger.info(f"Page: {page}x size:{page*page_size}): Successfully processed {len(page_data)} records")
+        logger.info(f"Page: {page} ({bucket_name}): Successfully processed {len(page_data)} records")
         
         return (page, len(page_data))
         
     except Exception as e:
-        with fetch_lock:
-            logger.error(f"Error processing page:{page} x size:{page_size} for {bucket_name.upper()}: {e}", exc_info=True)
+        logger.error(f"Error processing page:{page} for {bucket_name.upper()}: {e}", exc_info=True)
         return (page, 0)
-    finally:
-        del cb_service, mongo_service, page_data
-        gc.collect()
 
 def migrate_bucket(db_name: str, bucket_name: str, migrate_keep_structure: bool, 
                    page_size: int = 1000, max_workers: int = 5, 
-                   max_retries: int = 3, retry_delay: int = 2):
+                   max_retries: int = 3, retry_delay: int = 2, fetch_workers: int = 4):
     """
     Migrate data from Couchbase bucket to MongoDB collection.
-    Each page is processed by 1 thread: fetch from Couchbase and insert into MongoDB.
+    Fetching and inserting overlap: fetch_workers threads each read a range of document ids
+    with keyset pagination (no OFFSET rescans), while max_workers threads insert the pages
+    already fetched into MongoDB. At most 2 x max_workers fetched pages wait for an inserter.
     
     Args:
         db_name: MongoDB database name
         bucket_name: Couchbase bucket name (also the MongoDB collection name)
         migrate_keep_structure: True if migrate data with original structure, False if migrate data with RMS structure
         page_size: Number of records per page (default: 1000)
-        max_workers: Maximum number of threads (default: 5)
+        max_workers: Maximum number of insert threads (default: 5)
         max_retries: Maximum number of retries (default: 3)
         retry_delay: Delay between retries (default: 2)
+        fetch_workers: Number of Couchbase fetch threads (default: 4)
     """
-    cb_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
+    cb_service = _get_cb_service()
     try:
         # Lấy tổng số documents để tính số pages
         total_count = cb_service.get_total_count(bucket_name)
@@ -99,27 +158,21 @@ def migrate_bucket(db_name: str, bucket_name: str, migrate_keep_structure: bool,
         logger.info(f"{bucket_name.upper()} Total documents: {total_count}, Total pages: {total_pages}, Page size: {page_size}")
         total_processed = 0
         failed_pages = []
+        completed = 0
+        in_flight = set()
+        scan_error = None
+        # MongoDB collections this bucket wrote to: the only ones flushed at the end, so buckets
+        # migrated in parallel do not wait on each other's buffered documents
+        collections = set()
+        mongo_dal = _get_mongo_dal(db_name)
+        failed_before = dict(mongo_dal.failed_counts)
+        # store_page returns (page, count): futures need no page bookkeeping
+        run_page = partial(store_page, db_name, bucket_name, migrate_keep_structure, collections=collections)
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit tất cả các pages
-            future_to_page = {
-                executor.submit(
-                    process_page,
-                    db_name,
-                    bucket_name,
-                    migrate_keep_structure,
-                    page,
-                    page_size,
-                    max_retries,
-                    retry_delay
-                ): page
-                for page in range(total_pages)
-            }
-        
-            # Thu thập kết quả khi hoàn thành
-            completed = 0
-            for future in as_completed(future_to_page):
-                page = future_to_page[future]
+        def collect(return_when):
+            nonlocal in_flight, total_processed, completed
+            done, in_flight = wait(in_flight, return_when=return_when)
+            for future in done:
                 try:
                     result_page, processed_count = future.result()
                     total_processed += processed_count
@@ -129,35 +182,72 @@ def migrate_bucket(db_name: str, bucket_name: str, migrate_keep_structure: bool,
                     if processed_count == 0:
                         failed_pages.append(result_page)
                 except Exception as e:
-                    logger.error(f"Error getting result for page {page}: {e}", exc_info=True)
-                    failed_pages.append(page)
+                    # store_page handles its own errors: this is unexpected and the page is unknown
+                    logger.error(f"{bucket_name.upper()}: Error getting a page result: {e}", exc_info=True)
         
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            max_in_flight = 2 * max_workers
+            pages = cb_service.iter_data_partitioned(bucket_name, page_size, fetch_workers, max_retries, retry_delay,
+                                                     total_count=total_count)
+            try:
+                # Pages are numbered in arrival order
+                for page, page_data in enumerate(pages):
+                    in_flight.add(executor.submit(run_page, page, page_data))
+                    if len(in_flight) >= max_in_flight:
+                        collect(FIRST_COMPLETED)
+            except Exception as e:
+                # Some id range could not be read to its end: still insert the pages already fetched
+                scan_error = e
+                logger.error(f"{bucket_name.upper()}: Error fetching from Couchbase: {e}", exc_info=True)
+            collect(ALL_COMPLETED)
+        
+        # Pages hand their documents to the buffered writer: make sure nothing of this bucket is left
+        mongo_dal.flush(collections)
+        failed_documents = sum(mongo_dal.failed_counts.get(name, 0) - failed_before.get(name, 0)
+                               for name in collections)
+        if failed_documents:
+            logger.warning(f"{bucket_name.upper()}: {failed_documents} documents could not be inserted into "
+                           f"{', '.join(sorted(collections))}")
         logger.info(f"{bucket_name.upper()} Migration completed: {total_processed}/{total_count} records processed")
         if failed_pages:
             logger.warning(f"{bucket_name.upper()}: Failed to process {len(failed_pages)} pages: {failed_pages[:10]}...")
+        if scan_error is not None:
+            logger.warning(f"{bucket_name.upper()}: Migration incomplete, documents could not be fetched: {scan_error}")
             
     except Exception as e:
         logger.error(f"Error migrating bucket {bucket_name}: {e}", exc_info=True)
     finally:
-        del cb_service
-        gc.collect()
+        # The executor's worker threads are gone: close their connections.
+        # Other buckets may still be migrating in parallel, so their connections are kept.
+        _close_cb_services(finished_threads_only=True)
 
 def create_index(bucket_name: str, force: bool = False):
     """
     Create primary index on the bucket.
     Wait until index is online before migrating data
     """
+    couchbase_service = None
     try:
         couchbase_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
         couchbase_service.create_primary_index(bucket_name, force=force)
         _, state = couchbase_service.check_index_status(bucket_name)
+        # Exponential backoff (1s, 2s, 4s... capped at 10s): index builds on large buckets take
+        # minutes, no need to query index metadata and log every second
+        delay = 1
+        polls = 0
         while not state:
-            time.sleep(1)
-            _, state = couchbase_service.check_index_status(bucket_name)
-            logger.info(f"Index is not online yet...)")
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+            polls += 1
+            _, state = couchbase_service.check_index_status(bucket_name, ttl=0)
+            if not state and polls % 5 == 1:
+                logger.info(f"Index is not online yet for {bucket_name}...")
         logger.info(f"Bucket {bucket_name.upper()} is ready to fetch data")
     except Exception as e:
         logger.error(f"Error creating primary index for bucket {bucket_name}: {e}", exc_info=True)
+    finally:
+        if couchbase_service:
+            couchbase_service.cb_dal.close()
 
 def drop_collections(db_name: str):
     try:
@@ -165,55 +255,76 @@ def drop_collections(db_name: str):
         mongo_service.drop_collections()
     except Exception as e:
         logger.error(f"Error dropping collections from MongoDB: {e}", exc_info=True)
-    finally:
-        gc.collect()
     
 def migrate_all_buckets(migrate_keep_structure: bool, 
-                        page_size:int=1000, max_workers:int=8, max_retries:int=3, retry_delay:int=2):
+                        page_size:int=1000, max_workers:int=8, max_retries:int=3, retry_delay:int=2,
+                        parallel_buckets:int=None, fetch_workers:int=4):
     '''
     Migrate all buckets in setting file with parallel processing
     migrate_keep_structure: True if migrate data with original structure, 
     False if migrate data with RMS structure
+    parallel_buckets: Number of buckets of a database migrated at the same time (default: all of them).
+    max_workers threads are split between them, so the cluster sees about the same number of connections
+    fetch_workers: Number of Couchbase fetch threads, split between the parallel buckets like max_workers
     '''
     try:
         for db_name, bucket_names in DB_SETTING.items():
             drop_collections(db_name)
+            # Index DDL stays serial: only the data migration runs in parallel
             for bucket_name in bucket_names:
                 # check and create index if not exists
                 create_index(bucket_name, force=True)
-
-                logger.info("=" * 60)
-                logger.info(f"Migrating bucket: {bucket_name.upper()}")
-                logger.info(f"Configuration: page_size={page_size}, max_workers={max_workers}, "
-                            f"max_retries={max_retries}, retry_delay={retry_delay}s")
-                logger.info("=" * 60)
-                
-                migrate_bucket(
-                    db_name=db_name,
-                    bucket_name=bucket_name,
-                    migrate_keep_structure=migrate_keep_structure,
-                    page_size=page_size,
-                    max_workers=max_workers,
-                    max_retries=max_retries,
-                    retry_delay=retry_delay
-                )
+            
+            num_parallel = max(1, min(parallel_buckets or len(bucket_names), len(bucket_names)))
+            bucket_workers = max(1, max_workers // num_parallel)
+            bucket_fetch_workers = max(1, fetch_workers // num_parallel)
+            logger.info("=" * 60)
+            logger.info(f"Migrating buckets of {db_name.upper()}: {', '.join(bucket_names)}")
+            logger.info(f"Configuration: page_size={page_size}, parallel_buckets={num_parallel}, "
+                        f"fetch_workers per bucket={bucket_fetch_workers}, max_workers per bucket={bucket_workers}, "
+                        f"max_retries={max_retries}, retry_delay={retry_delay}s")
+            logger.info("=" * 60)
+            
+            # Buckets are independent: while one drains its last pages, the others keep the cluster busy
+            with ThreadPoolExecutor(max_workers=num_parallel) as bucket_executor:
+                futures = [
+                    bucket_executor.submit(
+                        migrate_bucket,
+                        db_name=db_name,
+                        bucket_name=bucket_name,
+                        migrate_keep_structure=migrate_keep_structure,
+                        page_size=page_size,
+                        max_workers=bucket_workers,
+                        max_retries=max_retries,
+                        retry_delay=retry_delay,
+                        fetch_workers=bucket_fetch_workers
+                    )
+                    for bucket_name in bucket_names
+                ]
+                for future in futures:
+                    future.result()
     except Exception as e:
         logger.error(f"Error migrating all buckets: {e}", exc_info=True)
-    finally:
-        gc.collect()
 
 def process_single(db_name:str, bucket_name: str, migrate_keep_structure: bool, 
                    page:int, page_size:int, max_retries:int, retry_delay:int):
-    'migrate data with single thread'
-    process_page(
-        db_name=db_name, 
-        bucket_name=bucket_name, 
-        migrate_keep_structure=migrate_keep_structure,
+    """
+    Migrate one page with single thread, fetched by its OFFSET (page * page_size).
+    migrate_bucket reads whole buckets with keyset pagination instead.
+    
+    Returns:
+        tuple: (page, success_count) or (page, 0) if failed (NO_DATA_FOUND)
+    """
+    page_data = _get_cb_service().get_data_paginated(
+        bucket_name=bucket_name,
         page=page,
         page_size=page_size,
         max_retries=max_retries,
         retry_delay=retry_delay
     )
+    if page_data is None:
+        return (page, 0)
+    return store_page(db_name, bucket_name, migrate_keep_structure, page, page_data)
         
     
 if __name__ == "__main__":
@@ -222,7 +333,8 @@ if __name__ == "__main__":
     # bucket_name = "rms_events"
     # page = 0
     page_size = 1000  # Number of records per page
-    max_workers = 8  # Maximum number of threads for parallel processing
+    max_workers = get_max_workers()  # Threads inserting into MongoDB (MIGRATE_MAX_WORKERS or 4 per CPU)
+    fetch_workers = 4  # Number of threads fetching from Couchbase
     max_retries = 3  # Maximum number of retries when timeout
     retry_delay = 2  # Delay between retries (seconds)
     migrate_keep_structure = False # migrate RMS data. update to True when migrate original data
@@ -233,7 +345,8 @@ if __name__ == "__main__":
         page_size=page_size, 
         max_workers=max_workers, 
         max_retries=max_retries, 
-        retry_delay=retry_delay
+        retry_delay=retry_delay,
+        fetch_workers=fetch_workers
     )
     
     # process_single(
@@ -1,14 +1,13 @@
 import os
 import sys
 import json
-import gc
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import CouchbaseConfig
+from config import CouchbaseConfig, get_max_workers
 from dal.couchbase_dal import CouchbaseDataAccess
 from services.couchbase_service import CouchbaseService
 from logger_config import setup_logging, get_logger
@@ -120,7 +119,6 @@ def export_bucket_to_json(bucket_name: str, output_dir: str = "exports",
     finally:
         if cb_service:
             cb_service.cb_dal.close()
-        gc.collect()
 
 
 def export_buckets_to_json(buckets_config: dict, output_dir: str = "exports",
@@ -209,7 +207,7 @@ def export_buckets_to_json(buckets_config: dict, output_dir: str = "exports",
     return results
 
 
-def import_json_to_bucket(bucket_name: str, file_path: str, batch_size: int = 100, 
+def import_json_to_bucket(bucket_name: str, file_path: str, batch_size: int = None, 
                           check_bucket: bool = True, create_if_not_exists: bool = True,
                           ram_quota_mb: int = 100, max_retries: int = 3, retry_delay: int = 2):
     """
@@ -218,7 +216,7 @@ def import_json_to_bucket(bucket_name: str, file_path: str, batch_size: int = 10
     Args:
         bucket_name: Name of the bucket to import data into
         file_path: Path to the JSON file
-        batch_size: Number of documents to process in each batch (default: 100)
+        batch_size: Number of documents to process in each batch (default: CB_UPSERT_BATCH_SIZE, 500)
         check_bucket: If True, check if bucket exists before importing (default: True)
         create_if_not_exists: If True, create bucket if it doesn't exist (default: True)
         ram_quota_mb: RAM quota in MB for new bucket (default: 100)
@@ -263,11 +261,10 @@ def import_json_to_bucket(bucket_name: str, file_path: str, batch_size: int = 10
     finally:
         if cb_service:
             cb_service.cb_dal.close()
-        gc.collect()
 
 
 def import_json_to_buckets(buckets_config: dict, input_dir: str = "exports",
-                           batch_size: int = 100, max_workers: int = 3,
+                           batch_size: int = None, max_workers: int = 3,
                            create_if_not_exists: bool = True, ram_quota_mb: int = 100,
                            max_retries: int = 3, retry_delay: int = 2):
     """
@@ -278,7 +275,7 @@ def import_json_to_buckets(buckets_config: dict, input_dir: str = "exports",
                        Example: {"db1": ["bucket1", "bucket2"], "db2": ["bucket3"]}
                        Or simple list: ["bucket1", "bucket2"]
         input_dir: Directory containing JSON files (default: "exports")
-        batch_size: Number of documents to process in each batch (default: 100)
+        batch_size: Number of documents to process in each batch (default: CB_UPSERT_BATCH_SIZE, 500)
         max_workers: Maximum number of parallel workers (default: 3)
         create_if_not_exists: If True, create buckets if they don't exist (default: True)
         ram_quota_mb: RAM quota in MB for new buckets (default: 100)
@@ -368,8 +365,8 @@ if __name__ == "__main__":
     # mode = 'export' 
     mode = 'import'
     page_size = 1000
-    batch_size = 100
-    max_workers = 8
+    batch_size = None  # CB_UPSERT_BATCH_SIZE (default: 500)
+    max_workers = get_max_workers()
     export_path = "exports"
     max_retries = 3
     retry_delay = 2
@@ -1,14 +1,12 @@
 import os
 import sys
-import gc
 import time
 import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import CouchbaseConfig, MongoDBConfig
+from config import CouchbaseConfig, MongoDBConfig, get_max_workers
 from dal.couchbase_dal import CouchbaseDataAccess
 from services.couchbase_service import CouchbaseService
 from logger_config import setup_logging, get_logger
@@ -19,9 +17,6 @@ from services.mongodb_service import MongoDBService
 setup_logging(log_dir='logs', log_level='INFO')
 logger = get_logger(__name__)
 
-# Thread-safe lock for logging
-fetch_lock = Lock()
-
 MECHOICE_BUCKETS = {
     "keep_structure" : ["mechoice_journal", "mechoice_workflow_journal", "mechoice_star_award_journal"],
     "restructure" : [ "mechoice_notification", "mechoice_report"],
@@ -80,20 +75,17 @@ def process_page_mechoice(db_name: str, bucket_name: str, migration_type: str, p
                 logger.error(f"Unknown migration type: {migration_type}")
                 return (page, 0)
             
-            with fetch_lock:
-                if len(page_data) > 0:
-                    logger.info(f"Page {page} (offset {page*page_size}): Successfully processed {len(page_data)} records for {bucket_name}")
+            if len(page_data) > 0:
+                logger.info(f"Page {page} (offset {page*page_size}): Successfully processed {len(page_data)} records for {bucket_name}")
             
             return (page, success_count)
             
         except Exception as e:
-            with fetch_lock:
-                logger.error(f"Error processing page {page} data for {bucket_name.upper()}: {e}", exc_info=True)
+            logger.error(f"Error processing page {page} data for {bucket_name.upper()}: {e}", exc_info=True)
             return (page, 0)
         
     except Exception as e:
-        with fetch_lock:
-            logger.error(f"Error processing page {page} for {bucket_name.upper()}: {e}", exc_info=True)
+        logger.error(f"Error processing page {page} for {bucket_name.upper()}: {e}", exc_info=True)
         return (page, 0)
     finally:
         if cb_service:
@@ -183,20 +175,29 @@ def create_index_mechoice(bucket_name: str, force: bool = False):
     Create primary index on the bucket.
     Wait until index is online before migrating data
     """
+    couchbase_service = None
     try:
         couchbase_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
         couchbase_service.create_primary_index(bucket_name, force=force)
         _, state = couchbase_service.check_index_status(bucket_name)
+        # Exponential backoff (1s, 2s, 4s... capped at 10s): index builds on large buckets take
+        # minutes, no need to query index metadata and log every second
+        delay = 1
+        polls = 0
         while not state:
-            time.sleep(1)
-            _, state = couchbase_service.check_index_status(bucket_name)
-            logger.info(f"Index is not online yet for {bucket_name}...")
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+            polls += 1
+            _, state = couchbase_service.check_index_status(bucket_name, ttl=0)
+            if not state and polls % 5 == 1:
+                logger.info(f"Index is not online yet for {bucket_name}...")
         logger.info(f"Bucket {bucket_name.upper()} is ready to fetch data")
     except Exception as e:
         logger.error(f"Error creating primary index for bucket {bucket_name}: {e}", exc_info=True)
     finally:
+        if couchbase_service:
+            couchbase_service.cb_dal.close()
         # Removed gc.collect() to prevent debugger hang
-        pass
 
 
 def migrate_mechoice_data(db_name: str = "mechoice", page_size: int = 1000, max_workers: int = 8,
@@ -267,7 +268,7 @@ if __name__ == "__main__":
     # Configuration
     db_name = "mechoice"
     page_size = 1000
-    max_workers = 8
+    max_workers = get_max_workers()
     max_retries = 3
     retry_delay = 2
     batch_size = 500  # Batch size for bulk insert
@@ -3,7 +3,6 @@ Report Generator for Load Test Results
 Creates comprehensive reports with charts comparing Couchbase and MongoDB performance
 """
 import os
-import sys
 import json
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
@@ -13,8 +12,6 @@ from datetime import datetime
 from typing import Dict, List
 import numpy as np
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from logger_config import get_logger
 
 logger = get_logger(__name__)
@@ -1,13 +1,8 @@
-import os
 import logging
-import json
-# import pandas as pd
-import gc
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
 import time
 
-from config import CouchbaseConfig, MongoDBConfig
+from config import CouchbaseConfig, MongoDBConfig, get_db_setting, get_max_workers
 from dal.couchbase_dal import CouchbaseDataAccess
 from dal.mongodb_dal import MongoDBDataAccess
 from logger_config import setup_logging, get_logger
@@ -15,20 +10,13 @@ from logger_config import setup_logging, get_logger
 from services.couchbase_service import CouchbaseService
 from services.mongodb_service import MongoDBService
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_SETTING_PATH = os.path.join(BASE_DIR, "dbsetting.json")
-
-
 # Setup logging
 setup_logging(log_dir='logs', log_level=logging.DEBUG)
 logger = get_logger(__name__)
 
-# Thread-safe lock for logging
-fetch_lock = Lock()
-
 # RMS_BUCKET_LIST = ["rms_events","rms_journal","rms_rating_model","rms_read_model","rms_view","rms_write_model"]
 
-DB_SETTING = json.load(open(DB_SETTING_PATH, 'r'))
+DB_SETTING = get_db_setting()
 
 def process_page(db_name: str, bucket_name: str, page: int, page_size: int, max_retries: int = 3, retry_delay: int = 2):
     """
@@ -66,10 +54,10 @@ def process_page(db_name: str, bucket_name: str, page: int, page_size: int, max_
             max_retries=max_retries,
             retry_delay=retry_delay
         )
+        cb_dal.close()
         
         if not page_data or len(page_data) == 0:
-            with fetch_lock:
-                logger.info(f"{bucket_name.upper()} Page {page} (offset {offset}): NO_DATA_FOUND")
+            logger.info(f"{bucket_name.upper()} Page {page} (offset {offset}): NO_DATA_FOUND")
             return (page, 0)
         
         # Insert vào MongoDB
@@ -77,20 +65,16 @@ def process_page(db_name: str, bucket_name: str, page: int, page_size: int, max_
         mongo_dal = MongoDBDataAccess(mongo_config)
         mongo_service = MongoDBService(mongo_dal, mapping_id=True)
         
-        mongo_service.process_rms_data(bucket_name, page_data)
+        mongo_service.process_rms_data(bucket_name, page, page_data)
         mongo_dal = None
         
-        with fetch_lock:
-            logger.info(f"{bucket_name.upper()} Page {page} (offset {offset}): Successfully processed {len(page_data)} records")
+        logger.info(f"{bucket_name.upper()} Page {page} (offset {offset}): Successfully processed {len(page_data)} records")
         
         return (page, len(page_data))
         
     except Exception as e:
-        with fetch_lock:
-            logger.error(f"{bucket_name.upper()} Error processing page {page} (offset {offset}): {e}", exc_info=True)
+        logger.error(f"{bucket_name.upper()} Error processing page {page} (offset {offset}): {e}", exc_info=True)
         return (page, 0)
-    finally:
-        gc.collect()
 
 def migrate_bucket(db_name: str, bucket_name: str, page_size: int = 1000, max_workers: int = 5, 
                    max_retries: int = 3, retry_delay: int = 2):
@@ -169,24 +153,36 @@ def migrate_bucket(db_name: str, bucket_name: str, page_size: int = 1000, max_wo
     except Exception as e:
         logger.error(f"Error migrating bucket {bucket_name}: {e}", exc_info=True)
     finally:
-        gc.collect()
+        if cb_dal:
+            cb_dal.close()
 
 def create_index(bucket_name: str):
     """
     Create primary index on the bucket.
     Wait until index is online before migrating data
     """
+    couchbase_service = None
     try:
         couchbase_service = CouchbaseService(CouchbaseDataAccess(CouchbaseConfig()))
         couchbase_service.create_primary_index(bucket_name)
         _, state = couchbase_service.check_index_status(bucket_name)
+        # Exponential backoff (1s, 2s, 4s... capped at 10s): index builds on large buckets take
+        # minutes, no need to query index metadata and log every second
+        delay = 1
+        polls = 0
         while not state:
-            time.sleep(1)
-            _, state = couchbase_service.check_index_status(bucket_name)
-            logger.info(f"Index is not online yet...)")
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+            polls += 1
+            _, state = couchbase_service.check_index_status(bucket_name, ttl=0)
+            if not state and polls % 5 == 1:
+                logger.info(f"Index is not online yet for {bucket_name}...")
         logger.info(f"Bucket {bucket_name.upper()} is ready to fetch data")
     except Exception as e:
         logger.error(f"Error creating primary index for bucket {bucket_name}: {e}", exc_info=True)
+    finally:
+        if couchbase_service:
+            couchbase_service.cb_dal.close()
 
 def drop_collections(db_name: str):
     try:
@@ -200,7 +196,7 @@ def drop_collections(db_name: str):
 if __name__ == "__main__":
     # Configuration
     page_size = 1000  # Số records mỗi page
-    max_workers = 5  # Số threads xử lý song song
+    max_workers = get_max_workers()  # Số threads xử lý song song (MIGRATE_MAX_WORKERS hoặc 4 x CPU)
     max_retries = 3  # Số lần retry tối đa khi timeout
     retry_delay = 2  # Thời gian delay giữa các retry (giây)
     
@@ -4,13 +4,11 @@ Tests Couchbase and MongoDB with concurrent users and generates comparison repor
 """
 import os
 import sys
-import json
 import time
 import logging
 from datetime import datetime
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
+from config import get_db_setting
 from load_test import LoadTester
 from report_generator import ReportGenerator
 from logger_config import setup_logging, get_logger
@@ -20,12 +18,12 @@ setup_logging(log_dir='logs', log_level=logging.INFO)
 logger = get_logger(__name__)
 
 # Load database settings
-DB_SETTING = json.load(open('./src/dbsetting.json', 'r'))
+DB_SETTING = get_db_setting()
 
 
 def run_load_test_suite(bucket_name: str, collection_name: str, db_name: str = None,
                        user_counts: list = None, query_type: str = "select_all",
-                       duration_seconds: int = None):
+                       duration_seconds: int = None, use_async: bool = False):
     """
     Run a complete load test suite with multiple concurrent user scenarios
     
@@ -36,6 +34,7 @@ def run_load_test_suite(bucket_name: str, collection_name: str, db_name: str = N
         user_counts: List of concurrent user counts to test (e.g., [10, 50, 100, 200, 500])
         query_type: Type of query to run ('count', 'select_all', 'select_paginated')
         duration_seconds: Duration to run each test in seconds (None = run once per user)
+        use_async: If True, run users as coroutines on one event loop instead of threads
     
     Returns:
         List of test result statistics
@@ -62,7 +61,8 @@ def run_load_test_suite(bucket_name: str, collection_name: str, db_name: str = N
         
         try:
             # Run test
-            stats = tester.run_concurrent_test(
+            run_test = tester.run_concurrent_test_async if use_async else tester.run_concurrent_test
+            stats = run_test(
                 num_users=num_users,
                 query_type=query_type,
                 duration_seconds=duration_seconds
@@ -92,6 +92,7 @@ def run_load_test_suite(bucket_name: str, collection_name: str, db_name: str = N
             logger.error(f"Lỗi khi test với {num_users} users: {e}", exc_info=True)
             continue
     
+    tester.close()
     return all_results
 
 
@@ -101,6 +102,7 @@ def main():
     user_counts = [10, 50, 100, 200, 500, 1000, 2000, 5000]  # Test với số lượng users rất lớn
     query_type = "select_all"  # Có thể thay đổi: 'count', 'select_all', 'select_paginated'
     duration_seconds = 30  # Chạy mỗi test trong 30 giây (None = chạy 1 lần mỗi user)
+    use_async = False  # True = mỗi user là một coroutine (acouchbase + pymongo async) thay vì một thread
     
     logger.info("=" * 80)
     logger.info("CHƯƠNG TRÌNH LOAD TEST VÀ SO SÁNH COUCHBASE vs MONGODB")
@@ -131,7 +133,8 @@ def main():
                     db_name=db_name,
                     user_counts=user_counts,
                     query_type=query_type,
-                    duration_seconds=duration_seconds
+                    duration_seconds=duration_seconds,
+                    use_async=use_async
                 )
                 
                 all_test_results[bucket_name] = results
@@ -1,11 +1,8 @@
-import gc
 import os
-import sys
 import json
-from typing import final
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dal.couchbase_dal import CouchbaseDataAccess
 from logger_config import get_logger
+from utils import json_dumps, json_loads
 from couchbase.exceptions import BucketNotFoundException
 
 logger = get_logger(__name__)
@@ -23,9 +20,9 @@ class CouchbaseService:
             logger.error(f"Error getting data from bucket {bucket_name}: {e}", exc_info=True)
             return None
 
-    def check_index_status(self, bucket_name: str):
+    def check_index_status(self, bucket_name: str, ttl: float = 2.0):
         try:
-            return self.cb_dal.check_index_status(bucket_name)
+            return self.cb_dal.check_index_status(bucket_name, ttl=ttl)
         except Exception as e:
             logger.error(f"Error checking index status for bucket {bucket_name}: {e}", exc_info=True)
             return None
@@ -78,9 +75,33 @@ class CouchbaseService:
         except Exception as e:
             logger.error(f"Error getting data from bucket {bucket_name}: {e}", exc_info=True)
             return None
-        finally:
-            self.cb_dal.close()
-            gc.collect()
+    
+    def iter_data_partitioned(self, bucket_name: str, page_size: int, partitions: int = 4,
+                              max_retries: int = 3, retry_delay: int = 2, total_count: int = None):
+        """
+        Iterate over the pages of a bucket fetched by `partitions` threads, each one scanning a
+        range of document ids with keyset pagination. Pages arrive in no particular order; the
+        fetchers run ahead of the caller by at most `partitions` pages.
+        
+        Args:
+            bucket_name: Name of the bucket
+            page_size: Number of records per page
+            partitions: Number of fetch threads / id ranges (default: 4)
+            max_retries: Maximum number of retries (default: 3)
+            retry_delay: Delay between retries (default: 2)
+            total_count: Document count from get_total_count, if already known (avoids counting again)
+        
+        Yields:
+            list: Documents of one page, with their id in 'id'
+        """
+        for _, page_data in self.cb_dal.get_all_data_partitioned(
+                bucket_name=bucket_name,
+                page_size=page_size,
+                partitions=partitions,
+                max_retries=max_retries,
+                retry_delay=retry_delay,
+                total_count=total_count):
+            yield page_data
     
     def export_data_to_json(self, bucket_name: str, data: list, file_path: str = None, append: bool = True):
         """
@@ -104,8 +125,8 @@ class CouchbaseService:
             
             if append and os.path.exists(file_path):
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        existing_data = json.load(f)
+                    with open(file_path, 'rb') as f:
+                        existing_data = json_loads(f.read())
                         if not isinstance(existing_data, list):
                             existing_data = [existing_data]
                         # Combine existing data with new data
@@ -119,7 +140,7 @@ class CouchbaseService:
             
             # Write to file
             with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(all_data, f, indent=2, ensure_ascii=False)
+                f.write(json_dumps(all_data, indent=True))
             
             logger.info(f"Exported {len(data)} documents to {file_path} (total: {len(all_data)} documents)")
             return file_path
@@ -168,7 +189,7 @@ class CouchbaseService:
             logger.error(f"Error creating bucket {bucket_name}: {e}", exc_info=True)
             return False
     
-    def load_json_to_bucket(self, bucket_name: str, file_path: str, batch_size: int = 100, 
+    def load_json_to_bucket(self, bucket_name: str, file_path: str, batch_size: int = None, 
                            check_bucket: bool = True, create_if_not_exists: bool = True,
                            ram_quota_mb: int = 100, max_retries: int = 3, retry_delay: int = 2):
         """
@@ -177,7 +198,7 @@ class CouchbaseService:
         Args:
             bucket_name: Name of the bucket to load data into
             file_path: Path to the JSON file
-            batch_size: Number of documents to process in each batch (default: 100)
+            batch_size: Number of documents to process in each batch (default: CB_UPSERT_BATCH_SIZE, 500)
             check_bucket: If True, check if bucket exists before importing (default: True)
             create_if_not_exists: If True, create bucket if it doesn't exist (default: True)
             ram_quota_mb: RAM quota in MB for new bucket (default: 100)
@@ -252,5 +273,4 @@ class CouchbaseService:
             logger.error(f"Error loading JSON to bucket {bucket_name}: {e}", exc_info=True)
             raise e
         finally:
-            self.cb_dal.close()
-            gc.collect()
\ No newline at end of file
+            self.cb_dal.close()
\ No newline at end of file
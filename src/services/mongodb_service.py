@@ -1,4 +1,3 @@
-import gc
 import json
 import re
 import uuid
@@ -75,7 +74,7 @@ class MongoDBService:
                                 processed_doc = None
                         except (json.JSONDecodeError, ValueError) as e2:
                             logger.warning(f"Failed to parse JSON string for collection {collection_name}: {e2}")
-                            logger.debug(f"Normalized string (first 500 chars): {normalized_str[:500]}")
+                            logger.debug("Normalized string (first 500 chars): %s", normalized_str[:500])
                             processed_doc = None
                 
                 if processed_doc is not None:
@@ -145,7 +144,7 @@ class MongoDBService:
                                     processed_doc = None
                             except (json.JSONDecodeError, ValueError) as e2:
                                 logger.warning(f"Failed to parse JSON string for collection {collection_name}: {e2}")
-                                logger.debug(f"Normalized string (first 500 chars): {normalized_str[:500]}")
+                                logger.debug("Normalized string (first 500 chars): %s", normalized_str[:500])
                                 processed_doc = None
                     
                     if processed_doc is not None:
@@ -196,7 +195,7 @@ class MongoDBService:
             if skipped_count > 0:
                 logger.warning(f"Skipped {skipped_count} invalid documents when adding to collection {collection_name}")
             
-            self.mongo_dal.add_documents(collection_name, _documents)
+            self._wait_written(self.mongo_dal.add_documents(collection_name, _documents))
             logger.info(f"Successfully added {len(_documents)} documents to MongoDB collection {collection_name}")
         except Exception as e:
             logger.error(f"Error adding documents to MongoDB: {e}", exc_info=True)
@@ -216,8 +215,27 @@ class MongoDBService:
             
 
 
+    @staticmethod
+    def _wait_written(pending):
+        """
+        Wait for the documents handed to mongo_dal.add_documents to be written.
+        A buffering DAL returns Futures; MongoDBDataAccess writes synchronously and returns None.
+        Raises the write error, if any.
+        """
+        for future in pending if isinstance(pending, list) else [pending]:
+            if future is not None:
+                future.result()
+
     def process_rms_data(self, bucket_name: str, page: int, data: list):
-        'process RMS data then insert into MongoDB'
+        """
+        Process RMS data then insert into MongoDB.
+        Documents of a group that cannot be inserted are dumped to {bucket_name}_{page}_error_{group}.json.
+        
+        Returns:
+            list: Names of the collections (groups) written to
+        Raises:
+            RuntimeError if some group could not be inserted
+        """
         try:
             default_group_key = "Others"
             group = {}
@@ -312,7 +330,10 @@ class MongoDBService:
             # with(open(f'{bucket_name}_group.json', 'w')) as f:
             #     json.dump(group, f, indent=2, ensure_ascii=False)
 
-            # Insert data into MongoDB
+            # Insert data into MongoDB: queue every group before waiting, so that a buffering DAL
+            # writes them together
+            pending_groups = []
+            failed_groups = []
             for group_key, group_value in group.items():
                 if group_value:  # Only process non-empty groups
                     # Filter out any None or non-dict values before inserting
@@ -320,16 +341,27 @@ class MongoDBService:
                     if valid_docs:
                         try:
                             BATCH_SIZE = 500
-                            for i in range(0, len(valid_docs), BATCH_SIZE):
-                                batch = valid_docs[i:i+BATCH_SIZE]
-                                self.mongo_dal.add_documents(group_key, batch, max_retries=5, retry_delay=3)
+                            pending = [
+                                self.mongo_dal.add_documents(group_key, valid_docs[i:i+BATCH_SIZE], max_retries=5, retry_delay=3)
+                                for i in range(0, len(valid_docs), BATCH_SIZE)
+                            ]
+                            pending_groups.append((group_key, valid_docs, pending))
                         except Exception as e:
-                            logger.error(f"ERROR_INSERT_MONGODB: {bucket_name.upper()}[{page}] - '{group_key}' | Error:{e}", exc_info=True)
-                            with open(f'{bucket_name}_{page}_error_{group_key}.json', 'w', encoding='utf-8') as f:
-                                json.dump(valid_docs, f, indent=2, ensure_ascii=False)
-                            continue
+                            self._dump_insert_error(bucket_name, page, group_key, valid_docs, e)
+                            failed_groups.append(group_key)
                     else:
                         logger.warning(f"No valid documents to insert for group '{group_key}' in {bucket_name}")
+            
+            for group_key, valid_docs, pending in pending_groups:
+                try:
+                    self._wait_written(pending)
+                except Exception as e:
+                    self._dump_insert_error(bucket_name, page, group_key, valid_docs, e)
+                    failed_groups.append(group_key)
+            
+            if failed_groups:
+                raise RuntimeError(f"Insert failed for groups {failed_groups} of {bucket_name.upper()}[{page}]")
+            return [group_key for group_key, _, _ in pending_groups]
 
         except Exception as e:
             logger.error(f"Error processing RMS data in {bucket_name}: {e}", exc_info=True)
@@ -338,6 +370,12 @@ class MongoDBService:
             self.mongo_dal.close()
             
 
+    @staticmethod
+    def _dump_insert_error(bucket_name: str, page: int, group_key: str, documents: list, error: Exception):
+        logger.error(f"ERROR_INSERT_MONGODB: {bucket_name.upper()}[{page}] - '{group_key}' | Error:{error}", exc_info=error)
+        with open(f'{bucket_name}_{page}_error_{group_key}.json', 'w', encoding='utf-8') as f:
+            json.dump(documents, f, indent=2, ensure_ascii=False)
+
     def _convert_doc_value(self, doc_value):
         """
         Convert doc_value from string to dict if needed.
@@ -400,9 +438,6 @@ class MongoDBService:
         except Exception as e:
             logger.error(f"Error checking duplicates in collection {collection_name}: {e}", exc_info=True)
             return set()
-        finally:
-            self.mongo_dal.close()
-            
 
     def process_mechoice_keep_structure(self, bucket_name: str, data: list, batch_size: int = 500):
         """
@@ -714,7 +749,7 @@ class MongoDBService:
                         batch = unique_docs[i:i+batch_size]
                         try:
                             self.mongo_dal.add_documents(collection_name, batch, max_retries=5, retry_delay=3)
-                            logger.debug(f"Inserted batch {i//batch_size + 1} ({len(batch)} documents) into {collection_name}")
+                            logger.debug("Inserted batch %d (%d documents) into %s", i // batch_size + 1, len(batch), collection_name)
                         except Exception as e:
                             logger.error(f"Error inserting batch into {collection_name}: {e}", exc_info=True)
                             raise e
@@ -870,7 +905,7 @@ class MongoDBService:
                         batch = modified_docs[i:i+batch_size]
                         try:
                             self.mongo_dal.add_documents(collection_name, batch, max_retries=5, retry_delay=3)
-                            logger.debug(f"Inserted batch {i//batch_size + 1} ({len(batch)} documents) into {collection_name}")
+                            logger.debug("Inserted batch %d (%d documents) into %s", i // batch_size + 1, len(batch), collection_name)
                         except Exception as e:
                             logger.error(f"Error inserting batch into {collection_name}: {e}", exc_info=True)
                             raise e
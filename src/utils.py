@@ -0,0 +1,85 @@
+"""
+Small helpers shared by the DAL, services and scripts.
+JSON encoding uses orjson when it is installed and falls back to the standard library.
+"""
+import json
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# MongoDB rejects BSON documents over 16 MiB; batches are kept under the same budget
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def json_dumps(obj, indent: bool = False, default=None) -> str:
+    """
+    Serialize obj to a JSON string (non-ASCII characters are kept as-is).
+
+    Args:
+        obj: Object to serialize
+        indent: If True, pretty-print with 2-space indentation
+        default: Callable used for objects that are not JSON serializable
+    """
+    if orjson is not None:
+        # Non-str dict keys are converted to strings, as the standard library does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+    return json.dumps(obj, default=default, ensure_ascii=False, indent=2 if indent else None)
+
+
+def json_size(obj, default=None) -> int:
+    """
+    Return the size in bytes of obj encoded as UTF-8 JSON (what goes on the wire),
+    not its length in characters.
+
+    Args:
+        obj: Object to measure
+        default: Callable used for objects that are not JSON serializable
+    """
+    if orjson is not None:
+        return len(orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS))
+    return len(json.dumps(obj, default=default, ensure_ascii=False).encode('utf-8'))
+
+
+def json_loads(data):
+    """
+    Parse a JSON document from str or bytes.
+    Raises json.JSONDecodeError (orjson's decode error is a subclass of it).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def chunked(iterable, size: int):
+    """
+    Split any iterable into lists of at most `size` items without materializing it.
+
+    Args:
+        iterable: Source items (list, generator, ...)
+        size: Maximum number of items per chunk
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def cap_batch_size(sample, batch_size: int, max_bytes: int = MAX_BATCH_BYTES) -> int:
+    """
+    Lower batch_size so that a batch of documents the size of `sample` stays under max_bytes.
+
+    Args:
+        sample: A representative document (None leaves batch_size unchanged)
+        batch_size: Requested number of documents per batch
+        max_bytes: Size budget for one batch (default: 16 MiB)
+    """
+    if sample is None:
+        return batch_size
+    doc_size = json_size(sample, default=str) or 1
+    return max(1, min(batch_size, max_bytes // doc_size))